@@ -1,89 +1,123 @@
 import streamlit as st
 import sys
+import numpy as np
 import pandas as pd
+from pathlib import Path
 
 from src.common import page_setup, save_params
-from src.masstable import getMSSignalDF, getSpectraTableDF
+from src.masstable import getHeatmapDF, getSpectraTableDF, getScanIndex, DEFAULT_HEATMAP_BUDGET
+from src.lazymzml import withPeakColumns
 from src.components import PlotlyHeatmap, PlotlyLineplot, Plotly3Dplot, Tabulator, SequenceView, InternalFragmentMap, \
-                           FlashViewerComponent, flash_viewer_grid_component
-from src.sequence import getFragmentDataFromSeq, getInternalFragmentDataFromSeq
+                           FlashViewerComponent, flash_viewer_grid_component, \
+                           getCachedPayload, sendsFragmentMatches
+from src.sequence import getFragmentDataFromSeq, getInternalFragmentDataFromSeq, getFixedModifications
+from src.fragmentmatch import FragmentIndex, matchScans, INTERNAL_ION_TYPES
 
 
 DEFAULT_LAYOUT = [['ms1_deconv_heat_map'], ['scan_table', 'mass_table'],
                   ['anno_spectrum', 'deconv_spectrum'], ['3D_SN_plot']]
 
 
-def sendDataToJS(selected_data, layout_info_per_exp, grid_key='flash_viewer_grid'):
-    # getting data
-    selected_anno_file = selected_data.iloc[0]['Annotated Files']
-    selected_deconv_file = selected_data.iloc[0]['Deconvolved Files']
-
-    # getting data from mzML files
-    spec_df = st.session_state['deconv_dfs'][selected_deconv_file]
-    anno_df = st.session_state['anno_dfs'][selected_anno_file]
-
+def getComponents(layout_info_per_exp):
     components = []
-    data_to_send = {}
-    per_scan_contents = {'mass_table': False, 'anno_spec': False, 'deconv_spec': False, '3d': False}
     for row in layout_info_per_exp:
         components_of_this_row = []
-        for col_index, comp_name in enumerate(row):
+        for comp_name in row:
             component_arguments = None
-
-            # prepare component arguments
             if comp_name == 'ms1_raw_heatmap':
-                data_to_send['raw_heatmap_df'] = getMSSignalDF(anno_df)
                 component_arguments = PlotlyHeatmap(title="Raw MS1 Heatmap")
             elif comp_name == 'ms1_deconv_heat_map':
-                data_to_send['deconv_heatmap_df'] = getMSSignalDF(spec_df)
                 component_arguments = PlotlyHeatmap(title="Deconvolved MS1 Heatmap")
             elif comp_name == 'scan_table':
-                data_to_send['per_scan_data'] = getSpectraTableDF(spec_df)
                 component_arguments = Tabulator('ScanTable')
             elif comp_name == 'deconv_spectrum':
-                per_scan_contents['deconv_spec'] = True
                 component_arguments = PlotlyLineplot(title="Deconvolved Spectrum")
             elif comp_name == 'anno_spectrum':
-                per_scan_contents['anno_spec'] = True
                 component_arguments = PlotlyLineplot(title="Annotated Spectrum")
             elif comp_name == 'mass_table':
-                per_scan_contents['mass_table'] = True
                 component_arguments = Tabulator('MassTable')
             elif comp_name == '3D_SN_plot':
-                per_scan_contents['3d'] = True
                 component_arguments = Plotly3Dplot(title="Precursor Signals")
             elif comp_name == 'sequence_view':
-                data_to_send['sequence_data'] = {0: getFragmentDataFromSeq(st.session_state.input_sequence)}
                 component_arguments = SequenceView()
             elif comp_name == 'internal_fragment_map':
-                data_to_send['internal_fragment_data'] = getInternalFragmentDataFromSeq(st.session_state.input_sequence)
                 component_arguments = InternalFragmentMap()
 
             components_of_this_row.append(FlashViewerComponent(component_arguments))
         components.append(components_of_this_row)
+    return components
+
+
+def getDataToSend(selected_anno_file, selected_deconv_file, layout_info_per_exp, heatmap_budget):
+    # getting data from mzML files
+    # peaks of experiments parsed in lazy mode are read from the mzML files by withPeakColumns, for the rows sent only
+    spec_df = st.session_state['deconv_dfs'][selected_deconv_file]
+    anno_df = st.session_state['anno_dfs'][selected_anno_file]
+    deconv_path = Path(st.session_state.workspace, 'deconv-mzMLs', selected_deconv_file)
+    anno_path = Path(st.session_state.workspace, 'anno-mzMLs', selected_anno_file)
+    peaks = st.session_state['deconv_peaks'][selected_deconv_file]
+    deconv_version = st.session_state['deconv_dfs'].getVersion(selected_deconv_file)
+    # MS1 views (heatmaps, precursor signals) only use the MS1 rows of the experiment
+    scan_index = getScanIndex((selected_deconv_file, deconv_version), spec_df)
+    ms1_rows = scan_index.rowsOfLevel(1)
+
+    data_to_send = {}
+    per_scan_contents = {'mass_table': False, 'anno_spec': False, 'deconv_spec': False, '3d': False}
+    for comp_name in [comp_name for row in layout_info_per_exp for comp_name in row]:
+        if comp_name == 'ms1_raw_heatmap':
+            data_to_send['raw_heatmap_df'] = getHeatmapDF(anno_path, 1, withPeakColumns(anno_df, anno_path, ms1_rows),
+                                                          heatmap_budget)
+        elif comp_name == 'ms1_deconv_heat_map':
+            data_to_send['deconv_heatmap_df'] = getHeatmapDF(
+                deconv_path, 1, withPeakColumns(spec_df, deconv_path, ms1_rows), heatmap_budget)
+        elif comp_name == 'scan_table':
+            data_to_send['per_scan_data'] = getSpectraTableDF(spec_df)
+        elif comp_name == 'deconv_spectrum':
+            per_scan_contents['deconv_spec'] = True
+        elif comp_name == 'anno_spectrum':
+            per_scan_contents['anno_spec'] = True
+        elif comp_name == 'mass_table':
+            per_scan_contents['mass_table'] = True
+        elif comp_name == '3D_SN_plot':
+            per_scan_contents['3d'] = True
+        elif comp_name == 'sequence_view':
+            data_to_send['sequence_data'] = {0: getFragmentDataFromSeq(st.session_state.input_sequence)}
+        elif comp_name == 'internal_fragment_map':
+            data_to_send['internal_fragment_data'] = getInternalFragmentDataFromSeq(st.session_state.input_sequence)
 
     if any(per_scan_contents.values()):
         scan_table = data_to_send['per_scan_data']
+        rows = scan_table.index
         dfs = [scan_table]
         for key, exist in per_scan_contents.items():
             if not exist: continue
 
             if key == 'mass_table':
-                tmp_df = spec_df[['mzarray', 'intarray', 'MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes',
-                                  'cos', 'snr', 'qscore']].copy()
+                tmp_df = withPeakColumns(spec_df, deconv_path, rows)[
+                    ['mzarray', 'intarray', 'MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes',
+                     'cos', 'snr', 'qscore']].copy()
                 tmp_df.rename(columns={'mzarray': 'MonoMass', 'intarray': 'SumIntensity', 'cos': 'CosineScore',
                                        'snr': 'SNR', 'qscore': 'QScore'},
                               inplace=True)
             elif key == 'deconv_spec':
                 if per_scan_contents['mass_table']: continue  # deconv_spec shares same data with mass_table
 
-                tmp_df = spec_df[['mzarray', 'intarray']].copy()
+                tmp_df = withPeakColumns(spec_df, deconv_path, rows)[['mzarray', 'intarray']].copy()
                 tmp_df.rename(columns={'mzarray': 'MonoMass', 'intarray': 'SumIntensity'}, inplace=True)
             elif key == 'anno_spec':
-                tmp_df = anno_df[['mzarray', 'intarray']].copy()
+                tmp_df = withPeakColumns(anno_df, anno_path, rows)[['mzarray', 'intarray']].copy()
                 tmp_df.rename(columns={'mzarray': 'MonoMass_Anno', 'intarray': 'SumIntensity_Anno'}, inplace=True)
             elif key == '3d':
-                tmp_df = spec_df[['PrecursorScan', 'SignalPeaks', 'NoisyPeaks']].copy()
+                # precursor signals come from MS1 scans, the other scans get no peaks
+                ms1_positions = np.flatnonzero(np.isin(rows, ms1_rows))
+                ms1_peaks = peaks.select(rows[ms1_positions])
+                signal_peaks, noisy_peaks = [[] for _ in rows], [[] for _ in rows]
+                for position, signal, noisy in zip(ms1_positions, ms1_peaks.toNestedList('signal'),
+                                                   ms1_peaks.toNestedList('noisy')):
+                    signal_peaks[position], noisy_peaks[position] = signal, noisy
+                tmp_df = spec_df.loc[rows, ['PrecursorScan']].copy()
+                tmp_df['SignalPeaks'] = signal_peaks
+                tmp_df['NoisyPeaks'] = noisy_peaks
             else:  # shouldn't come here
                 continue
 
@@ -94,7 +128,41 @@ def sendDataToJS(selected_data, layout_info_per_exp, grid_key='flash_viewer_grid
     if ('internal_fragment_data' in data_to_send) and ('sequence_data' not in data_to_send):
         data_to_send['sequence_data'] = {0 : getFragmentDataFromSeq(st.session_state.input_sequence)}
 
-    flash_viewer_grid_component(components=components, data=data_to_send, component_key=grid_key)
+    # the deconvolved masses of the MS2 scans matched to the fragment ions of the sequence
+    if sendsFragmentMatches() and \
+            ('sequence_data' in data_to_send or 'internal_fragment_data' in data_to_send):
+        fragment_index = FragmentIndex(
+            st.session_state.input_sequence, getFixedModifications(),
+            internal_ion_types=INTERNAL_ION_TYPES if 'internal_fragment_data' in data_to_send else (),
+            workspace=str(st.session_state.workspace))
+        ms2_rows = scan_index.rowsOfLevel(2)
+        data_to_send['fragment_ions'] = fragment_index.ions
+        data_to_send['fragment_matches'] = matchScans(
+            fragment_index, withPeakColumns(spec_df, deconv_path, ms2_rows)['mzarray'].to_list(),
+            spec_df.loc[ms2_rows, 'Scan'].to_numpy())
+
+    return data_to_send
+
+
+def sendDataToJS(selected_data, layout_info_per_exp, grid_key='flash_viewer_grid'):
+    # getting data
+    selected_anno_file = selected_data.iloc[0]['Annotated Files']
+    selected_deconv_file = selected_data.iloc[0]['Deconvolved Files']
+
+    heatmap_budget = st.session_state.get('heatmap-point-budget', DEFAULT_HEATMAP_BUDGET)
+    # the serialized data is reused as long as the experiment, its parsed data, the layout and the sequence settings
+    # do not change
+    cache_key = (selected_anno_file, selected_deconv_file,
+                 st.session_state['anno_dfs'].getVersion(selected_anno_file),
+                 st.session_state['deconv_dfs'].getVersion(selected_deconv_file),
+                 tuple(tuple(row) for row in layout_info_per_exp), heatmap_budget,
+                 st.session_state.get('input_sequence'), st.session_state.get('fixed_mod_cysteine'),
+                 st.session_state.get('fixed_mod_methionine'))
+    payload = getCachedPayload(cache_key, lambda: getDataToSend(selected_anno_file, selected_deconv_file,
+                                                                layout_info_per_exp, heatmap_budget))
+
+    flash_viewer_grid_component(components=getComponents(layout_info_per_exp), payload=payload,
+                                component_key=grid_key)
 
 
 def setSequenceViewInDefaultView():
@@ -1,8 +1,9 @@
 from src.common import *
 from src.masstable import *
+from src.lazymzml import withPeakColumns
 from src.components import *
 from src.sequence import getFragmentDataFromSeq, getInternalFragmentDataFromSeq
-from io import StringIO, BytesIO
+from io import BytesIO
 from zipfile import ZipFile, ZIP_DEFLATED
 from pages.FileUploadTagger import handleInputFiles
 from pages.FileUploadTagger import parseUploadedFiles
@@ -19,163 +20,137 @@ DEFAULT_LAYOUT = [
 # Annotated Spectrum will be replaced with new component including tags
 
 
-def sendDataToJS(selected_data, layout_info_per_exp, grid_key='flash_viewer_grid'):
-
-    selected_anno_file = selected_data.iloc[0]['Annotated Files']
-    selected_deconv_file = selected_data.iloc[0]['Deconvolved Files']
-    selected_tag_file = selected_data.iloc[0]['Tag Files']
-    selected_db_file = selected_data.iloc[0]['Protein Files']
-
-    # getting data from mzML files
-    spec_df = st.session_state['deconv_dfs_tagger'][selected_deconv_file]
-    anno_df = st.session_state['anno_dfs_tagger'][selected_anno_file]
-    tag_df = st.session_state['tag_dfs_tagger'][selected_tag_file]
-
-    # Process tag df into a linear data format
-    new_tag_df = {c : [] for c in tag_df.columns}
-    for i, row in tag_df.iterrows():
-        # No splitting if it is not recognized as string
-        if pd.isna(row['ProteinIndex']):
-            continue
-        if isinstance(row['ProteinIndex'], str) and (';' in row['ProteinIndex']):
-            no_items = row['ProteinIndex'].count(';') + 1
-            for c in new_tag_df.keys():
-                if (isinstance(row[c], str)) and (';' in row[c]):
-                    new_tag_df[c] += row[c].split(';')
-                else:
-                    new_tag_df[c] += [row[c]]*no_items
-        else:
-            for c in new_tag_df.keys():
-                new_tag_df[c].append(row[c])
-    tag_df = pd.DataFrame(new_tag_df)
-
-    tsv_buffer = StringIO()
-    tag_df.to_csv(tsv_buffer, sep='\t', index=False)
-    tsv_buffer.seek(0)
-    tag_df = pd.read_csv(tsv_buffer, sep='\t')
-
-    # Complete df
-    tag_df['Scan'] = 0
-    tag_df['EndPos'] = tag_df['StartPos'] + tag_df['Length'] - 1
-    tag_df['StartPos'] = tag_df['StartPos']
-    tag_df = tag_df.rename(
-        columns={
-            'DeNovoScore' : 'Score',
-            'Masses' : 'mzs'
-        }
-    )
-
-    # protein_db = st.session_state['protein_db'][selected_db_file]
-    protein_df = st.session_state['protein_dfs_tagger'][selected_db_file]
-    protein_df['length'] = protein_df['ProteinSequence'].apply(lambda x : len(x))
-    protein_df = protein_df.rename(
-        columns={
-            'ProteinIndex' : 'index',
-            'ProteinAccession' : 'accession',
-            'ProteinDescription' : 'description',
-            'ProteinSequence' : 'sequence'
-        }
-    )
-
-    sequence_data = {}
-    # Compute coverage
-    for i, row in protein_df.iterrows():
-        pid = row['index']
-        sequence = row['sequence']
-        coverage = np.zeros(len(sequence), dtype='float')
-        for i in range(len(sequence)):
-            coverage[i] = np.sum(
-                (tag_df['ProteinIndex'] == pid) &
-                (tag_df['StartPos'] <= i) &
-                (tag_df['EndPos'] >= i)
-            )
-        p_cov = np.zeros(len(coverage))
-        if np.max(coverage) > 0:
-            p_cov = coverage/np.max(coverage)
-        sequence_data[pid] = getFragmentDataFromSeq(
-            str(sequence), p_cov, np.max(coverage)
-        )
-
+def getComponents(layout_info_per_exp):
     components = []
-    data_to_send = {}
-    per_scan_contents = {'mass_table': False, 'anno_spec': False, 'deconv_spec': False, '3d': False}
     for row in layout_info_per_exp:
         components_of_this_row = []
-        for col_index, comp_name in enumerate(row):
+        for comp_name in row:
             component_arguments = None
-
-            # prepare component arguments
             if comp_name == 'ms1_raw_heatmap':
-                data_to_send['raw_heatmap_df'] = getMSSignalDF(anno_df)
                 component_arguments = PlotlyHeatmap(title="Raw MS1 Heatmap")
             elif comp_name == 'ms1_deconv_heat_map':
-                data_to_send['deconv_heatmap_df'] = getMSSignalDF(spec_df)
                 component_arguments = PlotlyHeatmap(title="Deconvolved MS1 Heatmap")
             elif comp_name == 'scan_table':
-                data_to_send['per_scan_data'] = getSpectraTableDF(spec_df)
                 component_arguments = Tabulator('ScanTable')
             elif comp_name == 'deconv_spectrum':
-                per_scan_contents['deconv_spec'] = True
-                per_scan_contents['anno_spec'] = True
                 component_arguments = PlotlyLineplotTagger(title="Deconvolved Spectrum")
             elif comp_name == 'anno_spectrum':
-                per_scan_contents['anno_spec'] = True
                 component_arguments = PlotlyLineplotTagger(title="Annotated Spectrum")
             elif comp_name == 'mass_table':
-                per_scan_contents['mass_table'] = True
                 component_arguments = Tabulator('MassTable')
             elif comp_name == 'protein_table':
-                data_to_send['protein_table'] = protein_df
-                data_to_send['per_scan_data'] = getSpectraTableDF(spec_df)
                 component_arguments = Tabulator('ProteinTable')
             elif comp_name == 'tag_table':
-                data_to_send['tag_table'] = tag_df
                 component_arguments = Tabulator('TagTable')
             elif comp_name == '3D_SN_plot':
-                per_scan_contents['3d'] = True
                 component_arguments = Plotly3Dplot(title="Precursor Signals")
             elif comp_name == 'sequence_view':
-            #    data_to_send['sequence_data'] = getFragmentDataFromSeq(st.session_state.input_sequence)
                 component_arguments = SequenceViewTagger()
             elif comp_name == 'internal_fragment_map':
-            #    data_to_send['internal_fragment_data'] = getInternalFragmentDataFromSeq(st.session_state.input_sequence)
                 component_arguments = InternalFragmentMap()
 
             components_of_this_row.append(FlashViewerComponent(component_arguments))
         components.append(components_of_this_row)
-    per_scan_contents['3d'] = True
-    if any(per_scan_contents.values()):
-        scan_table = data_to_send['per_scan_data']
-        dfs = [scan_table]
-        for key, exist in per_scan_contents.items():
-            if not exist: continue
-
-            if key == 'mass_table':
-                tmp_df = spec_df[['mzarray', 'intarray', 'MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes',
-                                  'cos', 'snr', 'qscore']].copy()
-                tmp_df.rename(columns={'mzarray': 'MonoMass', 'intarray': 'SumIntensity', 'cos': 'CosineScore',
-                                       'snr': 'SNR', 'qscore': 'QScore'},
-                              inplace=True)
-            elif key == 'deconv_spec':
-                if per_scan_contents['mass_table']: continue  # deconv_spec shares same data with mass_table
-
-                tmp_df = spec_df[['mzarray', 'intarray', 'CombinedPeaks']].copy()
-                tmp_df.rename(columns={'mzarray': 'MonoMass', 'intarray': 'SumIntensity'}, inplace=True)
-            elif key == 'anno_spec':
-                tmp_df = anno_df[['mzarray', 'intarray']].copy()
-                tmp_df.rename(columns={'mzarray': 'MonoMass_Anno', 'intarray': 'SumIntensity_Anno'}, inplace=True)
-            elif key == '3d':
-                tmp_df = spec_df[['PrecursorScan', 'SignalPeaks', 'NoisyPeaks']].copy()
-            else:  # shouldn't come here
-                continue
-
-            dfs.append(tmp_df)
-        data_to_send['per_scan_data'] = pd.concat(dfs, axis=1)
+    return components
+
+
+def getDataToSend(selected_anno_file, selected_deconv_file, selected_tag_file, layout_info_per_exp, heatmap_budget):
+    # getting data from mzML files
+    # the heatmaps show the MS1 scans, the other views only the MS2 scans
+    spec_df = st.session_state['deconv_dfs_tagger'][selected_deconv_file]
+    anno_df = st.session_state['anno_dfs_tagger'][selected_anno_file]
+    deconv_path = Path(st.session_state.workspace, 'deconv-mzMLs', selected_deconv_file)
+    anno_path = Path(st.session_state.workspace, 'anno-mzMLs', selected_anno_file)
+    scan_index = getScanIndex(
+        (selected_deconv_file, st.session_state['deconv_dfs_tagger'].getVersion(selected_deconv_file)), spec_df)
+    ms1_rows = scan_index.rowsOfLevel(1)
+    ms2_rows = scan_index.rowsOfLevel(2)
+    # tag and protein tables, coverage and fragment masses are prepared when the experiment is parsed
+    view_model = st.session_state['tagger_view_models'][selected_tag_file]
+
+    data_to_send = {}
+    per_scan_contents = {'mass_table': False, 'anno_spec': False, 'deconv_spec': False, '3d': True}
+    for comp_name in [comp_name for row in layout_info_per_exp for comp_name in row]:
+        if comp_name == 'ms1_raw_heatmap':
+            # peaks of experiments parsed in lazy mode are read from the mzML files here
+            data_to_send['raw_heatmap_df'] = getHeatmapDF(anno_path, 1, withPeakColumns(anno_df, anno_path, ms1_rows),
+                                                          heatmap_budget)
+        elif comp_name == 'ms1_deconv_heat_map':
+            data_to_send['deconv_heatmap_df'] = getHeatmapDF(
+                deconv_path, 1, withPeakColumns(spec_df, deconv_path, ms1_rows), heatmap_budget)
+        elif comp_name == 'deconv_spectrum':
+            per_scan_contents['deconv_spec'] = True
+            per_scan_contents['anno_spec'] = True
+        elif comp_name == 'anno_spectrum':
+            per_scan_contents['anno_spec'] = True
+        elif comp_name == 'mass_table':
+            per_scan_contents['mass_table'] = True
+        elif comp_name == 'protein_table':
+            data_to_send['protein_table'] = view_model.protein_table
+        elif comp_name == 'tag_table':
+            data_to_send['tag_table'] = view_model.tag_table
+        elif comp_name == '3D_SN_plot':
+            per_scan_contents['3d'] = True
+
+    # the scan table of the MS2 scans is always sent, the other views select their scan from it
+    scan_table = getSpectraTableDF(spec_df.loc[ms2_rows].reset_index(drop=True))
+    dfs = [scan_table]
+    for key, exist in per_scan_contents.items():
+        if not exist: continue
+
+        if key == 'mass_table':
+            tmp_df = withPeakColumns(spec_df, deconv_path, ms2_rows)[
+                ['mzarray', 'intarray', 'MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes',
+                 'cos', 'snr', 'qscore']].copy()
+            tmp_df.rename(columns={'mzarray': 'MonoMass', 'intarray': 'SumIntensity', 'cos': 'CosineScore',
+                                   'snr': 'SNR', 'qscore': 'QScore'},
+                          inplace=True)
+        elif key == 'deconv_spec':
+            if per_scan_contents['mass_table']: continue  # deconv_spec shares same data with mass_table
+
+            tmp_df = withPeakColumns(spec_df, deconv_path, ms2_rows)[['mzarray', 'intarray']].copy()
+            tmp_df['CombinedPeaks'] = st.session_state['deconv_peaks_tagger'][selected_deconv_file] \
+                .select(ms2_rows).toNestedList('noisy')
+            tmp_df.rename(columns={'mzarray': 'MonoMass', 'intarray': 'SumIntensity'}, inplace=True)
+        elif key == 'anno_spec':
+            tmp_df = withPeakColumns(anno_df, anno_path, ms2_rows)[['mzarray', 'intarray']].copy()
+            tmp_df.rename(columns={'mzarray': 'MonoMass_Anno', 'intarray': 'SumIntensity_Anno'}, inplace=True)
+        elif key == '3d':
+            peaks = st.session_state['deconv_peaks_tagger'][selected_deconv_file].select(ms2_rows)
+            tmp_df = spec_df.loc[ms2_rows, ['PrecursorScan']].copy()
+            tmp_df['SignalPeaks'] = peaks.toNestedList('signal')
+            tmp_df['NoisyPeaks'] = peaks.toNestedList('noisy')
+        else:  # shouldn't come here
+            continue
+
+        dfs.append(tmp_df.reset_index(drop=True))
+    data_to_send['per_scan_data'] = pd.concat(dfs, axis=1)
 
     # Set sequence data
-    data_to_send['sequence_data'] = sequence_data
+    data_to_send['sequence_data'] = view_model.getSequenceData()
+    return data_to_send
+
+
+def sendDataToJS(selected_data, layout_info_per_exp, grid_key='flash_viewer_grid'):
+
+    selected_anno_file = selected_data.iloc[0]['Annotated Files']
+    selected_deconv_file = selected_data.iloc[0]['Deconvolved Files']
+    selected_tag_file = selected_data.iloc[0]['Tag Files']
+
+    heatmap_budget = st.session_state.get('heatmap-point-budget', DEFAULT_HEATMAP_BUDGET)
+    # the serialized data is reused as long as the experiment, its parsed data, the layout and the fixed
+    # modifications do not change: the peaks of lazily parsed experiments are only read when it is assembled
+    cache_key = ('tagger', selected_anno_file, selected_deconv_file, selected_tag_file,
+                 st.session_state['anno_dfs_tagger'].getVersion(selected_anno_file),
+                 st.session_state['deconv_dfs_tagger'].getVersion(selected_deconv_file),
+                 st.session_state['tagger_view_models'][selected_tag_file].version,
+                 tuple(tuple(row) for row in layout_info_per_exp), heatmap_budget,
+                 st.session_state.get('fixed_mod_cysteine'), st.session_state.get('fixed_mod_methionine'))
+    payload = getCachedPayload(cache_key, lambda: getDataToSend(selected_anno_file, selected_deconv_file,
+                                                                selected_tag_file, layout_info_per_exp, heatmap_budget))
 
-    flash_viewer_grid_component(components=components, data=data_to_send, component_key=grid_key)
+    flash_viewer_grid_component(components=getComponents(layout_info_per_exp), payload=payload,
+                                component_key=grid_key)
 
 
 def setSequenceViewInDefaultView():
@@ -189,7 +164,8 @@ def content():
     #setSequenceViewInDefaultView()
     st.session_state['progress_bar_space'] = st.container()
     input_types = ["deconv-mzMLs", "anno-mzMLs", "tags-tsv", "proteins-tsv"]
-    parsed_df_types = ["deconv_dfs_tagger", "anno_dfs_tagger", "tag_dfs_tagger", "protein_dfs_tagger"]
+    parsed_df_types = ["deconv_dfs_tagger", "anno_dfs_tagger", "tag_dfs_tagger", "protein_dfs_tagger",
+                       "deconv_peaks_tagger", "tagger_view_models"]
     initializeWorkspace(input_types, parsed_df_types)
     parseUploadedFiles()
     showUploadedFilesTable()
@@ -4,12 +4,16 @@ from pathlib import Path
 import os
 import shutil
 
-from src.masstable import parseFLASHDeconvOutput
+from src.masstable import loadFLASHDeconvOutputs, removeParsedOutput
+from src.parsecache import CACHE_DIR_NAME, getChangedExperiments, recordParsedFiles
+from src.experimentstore import ExperimentStore, setMemoryBudget, DEFAULT_MEMORY_BUDGET_MB
 from src.common import page_setup, v_space, save_params, reset_directory
 
 
 input_file_types = ["deconv-mzMLs", "anno-mzMLs"]
 parsed_df_types = ["deconv_dfs", "anno_dfs"]
+parsed_peak_type = "deconv_peaks"  # RaggedPeaks of each deconvolved file
+stored_df_types = parsed_df_types + [parsed_peak_type]  # parsed mzML data, kept within the memory budget
 
 
 def initializeWorkspace(input_file_types_: list, parsed_df_types_: list) -> None:
@@ -26,9 +30,11 @@ def initializeWorkspace(input_file_types_: list, parsed_df_types_: list) -> None
         st.session_state[dirname] = os.listdir(Path(st.session_state.workspace, dirname))
 
     # initializing session state for storing data
+    setMemoryBudget(st.session_state.get("experiment-memory-budget", DEFAULT_MEMORY_BUDGET_MB))
     for df_type in parsed_df_types_:
         if df_type not in st.session_state:
-            st.session_state[df_type] = {}
+            st.session_state[df_type] = ExperimentStore(st.session_state.workspace) \
+                if df_type in stored_df_types else {}
 
 
 @st.cache_data
@@ -66,6 +72,9 @@ def remove_selected_mzML_files(to_remove: list[str], params: dict) -> dict:
             file_name = exp_name + file_postfix
             Path(mzml_dir, file_name).unlink()
             del st.session_state[df_type][file_name]  # removing key
+            if df_type == 'deconv_dfs':
+                del st.session_state[parsed_peak_type][file_name]
+                removeParsedOutput(st.session_state["workspace"], file_name)
         # for k, v in params.items():
         #     if isinstance(v, list):
         #         if f in v:
@@ -98,13 +107,18 @@ def handleInputFiles(uploaded_files):
             st.session_state[session_name].append(file.name)
 
 
-def parseUploadedFiles():
+def parseUploadedFiles(reparse=False):
     # get newly uploaded files
     deconv_files = st.session_state['deconv-mzMLs']
     anno_files = st.session_state['anno-mzMLs']
     # anno_files = Path(st.session_state['anno-mzMLs']).iterdir()
-    new_deconv_files = [f for f in deconv_files if f not in st.session_state['deconv_dfs']]
-    new_anno_files = [f for f in anno_files if f not in st.session_state['anno_dfs']]
+    # when reparsing, only the experiments whose files changed since they were parsed are parsed again
+    changed = getChangedExperiments(st.session_state["workspace"],
+                                    {'deconv-mzMLs': deconv_files, 'anno-mzMLs': anno_files}) if reparse else set()
+    new_deconv_files = [f for f in deconv_files
+                        if f not in st.session_state['deconv_dfs'] or f[0: f.rfind('_')] in changed]
+    new_anno_files = [f for f in anno_files
+                      if f not in st.session_state['anno_dfs'] or f[0: f.rfind('_')] in changed]
 
     # if newly uploaded files are not as needed
     if len(new_deconv_files) == 0 and len(new_anno_files) == 0:  # if no newly uploaded files, move on
@@ -121,21 +135,28 @@ def parseUploadedFiles():
     new_deconv_files = sorted(new_deconv_files)
     new_anno_files = sorted(new_anno_files)
 
-    # parse with progress bar
+    # parse with progress bar, experiments are parsed in parallel and stored as soon as they are done
+    experiments = [(anno_f, deconv_f) for anno_f, deconv_f in zip(new_anno_files, new_deconv_files)
+                   if anno_f.endswith('.mzML')]
     with st.session_state['progress_bar_space']:
-        for anno_f, deconv_f in zip(new_anno_files, new_deconv_files):
-            if not anno_f.endswith('.mzML'):
-                continue
+        progress_bar = st.progress(0, 'Parsing %d experiment(s)...' % len(experiments))
+        parsed_experiments = loadFLASHDeconvOutputs(
+            [(Path(st.session_state["workspace"], "anno-mzMLs", anno_f),
+              Path(st.session_state["workspace"], "deconv-mzMLs", deconv_f)) for anno_f, deconv_f in experiments],
+            st.session_state["workspace"], st.session_state.get("lazy-mzML", False)
+        )
+        for n_done, (index, parsed) in enumerate(parsed_experiments, start=1):
+            anno_f, deconv_f = experiments[index]
             exp_name = anno_f[0: anno_f.rfind('_')]
-
-            with st.spinner('Parsing the experiment %s...' % exp_name):
-                spec_df, anno_df, tolerance, massoffset, chargemass = parseFLASHDeconvOutput(
-                    Path(st.session_state["workspace"], "anno-mzMLs", anno_f),
-                    Path(st.session_state["workspace"], "deconv-mzMLs", deconv_f)
-                )
-                st.session_state['anno_dfs'][anno_f] = anno_df
-                st.session_state['deconv_dfs'][deconv_f] = spec_df
+            spec_df, anno_df, peaks, tolerance, massoffset, chargemass = parsed
+            st.session_state['anno_dfs'][anno_f] = anno_df
+            st.session_state['deconv_dfs'][deconv_f] = spec_df
+            st.session_state[parsed_peak_type][deconv_f] = peaks
+            recordParsedFiles(st.session_state["workspace"], [Path(st.session_state["workspace"], "anno-mzMLs", anno_f),
+                                                             Path(st.session_state["workspace"], "deconv-mzMLs", deconv_f)])
+            progress_bar.progress(n_done / len(experiments), 'Parsed %d of %d experiment(s)' % (n_done, len(experiments)))
             st.success('Done parsing the experiment %s!' % exp_name)
+        progress_bar.empty()
 
 
 def showUploadedFilesTable() -> bool:
@@ -165,9 +186,9 @@ def showUploadedFilesTable() -> bool:
 
 # for Workflow
 def postprocessingAfterUpload_FD(uploaded_files: list) -> None:
-    initializeWorkspace(input_file_types, parsed_df_types)
+    initializeWorkspace(input_file_types, parsed_df_types + [parsed_peak_type])
     #handleInputFiles(uploaded_files)
-    parseUploadedFiles()
+    parseUploadedFiles(reparse=True)
     showUploadedFilesTable()
 
 
@@ -177,7 +198,7 @@ if __name__ == '__main__':
     params = page_setup()
 
     # make directory to store deconv and anno mzML files & initialize data storage
-    initializeWorkspace(input_file_types, parsed_df_types)
+    initializeWorkspace(input_file_types, parsed_df_types + [parsed_peak_type])
 
     st.title("FLASHDeconv output files Upload")
 
@@ -257,7 +278,10 @@ if __name__ == '__main__':
                         reset_directory(Path(st.session_state.workspace, file_option))
                         st.session_state[file_option] = []
                     if df_option in st.session_state:
-                        st.session_state[df_option] = {}
+                        st.session_state[df_option].clear()
+                        if df_option == 'deconv_dfs':
+                            st.session_state[parsed_peak_type].clear()
+                            reset_directory(Path(st.session_state.workspace, CACHE_DIR_NAME))
 
                         # for k, v in params.items():
                         #     if df_option in k and isinstance(v, list):
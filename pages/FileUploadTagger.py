@@ -3,12 +3,18 @@ import pandas as pd
 from pathlib import Path
 import os, shutil
 import numpy as np
-from src.masstable import parseFLASHDeconvOutput, parseFLASHTaggerOutput
+from src.masstable import loadFLASHDeconvOutputs, parseFLASHTaggerOutput, removeParsedOutput
+from src.parsecache import CACHE_DIR_NAME, getChangedExperiments, recordParsedFiles
+from src.experimentstore import ExperimentStore, setMemoryBudget, DEFAULT_MEMORY_BUDGET_MB
+from src.taggerview import TaggerViewModel
 from src.common import page_setup, v_space, save_params, reset_directory
 
 
 input_file_types = ["deconv-mzMLs", "anno-mzMLs", "tags-tsv", "proteins-tsv"]
 parsed_df_types = ["deconv_dfs_tagger", "anno_dfs_tagger", "tag_dfs_tagger", "protein_dfs_tagger"]
+parsed_peak_type = "deconv_peaks_tagger"  # RaggedPeaks of each deconvolved file
+view_model_type = "tagger_view_models"  # TaggerViewModel of each tag file
+stored_df_types = parsed_df_types[:2] + [parsed_peak_type]  # parsed mzML data, kept within the memory budget
 
 
 def initializeWorkspace(input_file_types_: list, parsed_df_types_: list) -> None:
@@ -25,9 +31,11 @@ def initializeWorkspace(input_file_types_: list, parsed_df_types_: list) -> None
         st.session_state[dirname] = os.listdir(Path(st.session_state.workspace, dirname))
 
     # initializing session state for storing data
+    setMemoryBudget(st.session_state.get("experiment-memory-budget", DEFAULT_MEMORY_BUDGET_MB))
     for df_type in parsed_df_types_:
         if df_type not in st.session_state:
-            st.session_state[df_type] = {}
+            st.session_state[df_type] = ExperimentStore(st.session_state.workspace) \
+                if df_type in stored_df_types else {}
 
 #@st.cache_data
 def getUploadedFileDF(deconv_files, anno_files, tag_files, db_files):
@@ -67,6 +75,11 @@ def remove_selected_mzML_files(to_remove: list[str], params: dict) -> dict:
             file_name = exp_name + file_postfix
             Path(mzml_dir, file_name).unlink()
             del st.session_state[df_type][file_name]  # removing key
+            if df_type == 'deconv_dfs_tagger':
+                del st.session_state[parsed_peak_type][file_name]
+                removeParsedOutput(st.session_state["workspace"], file_name)
+            elif df_type == 'tag_dfs_tagger':
+                st.session_state[view_model_type].pop(file_name, None)
 
     # update the experiment df table
     tmp_df = st.session_state["experiment-df"]
@@ -134,10 +147,18 @@ def parseUploadedFiles(reparse=False):
     # db_files = st.session_state['db-fasta']
     protein_files = st.session_state['proteins-tsv']
     # anno_files = Path(st.session_state['anno-mzMLs']).iterdir()
-    new_deconv_files = [f for f in deconv_files if f not in st.session_state['deconv_dfs_tagger'] or reparse]
-    new_anno_files = [f for f in anno_files if f not in st.session_state['anno_dfs_tagger'] or reparse]
-    new_tag_files = [f for f in tag_files if f not in st.session_state['tag_dfs_tagger'] or reparse]
-    new_protein_files = [f for f in protein_files if f not in st.session_state['protein_dfs_tagger'] or reparse]
+    # when reparsing, only the experiments whose files changed since they were parsed are parsed again
+    changed = getChangedExperiments(st.session_state["workspace"],
+                                    {'deconv-mzMLs': deconv_files, 'anno-mzMLs': anno_files,
+                                     'tags-tsv': tag_files, 'proteins-tsv': protein_files}) if reparse else set()
+    new_deconv_files = [f for f in deconv_files
+                        if f not in st.session_state['deconv_dfs_tagger'] or f[0: f.rfind('_')] in changed]
+    new_anno_files = [f for f in anno_files
+                      if f not in st.session_state['anno_dfs_tagger'] or f[0: f.rfind('_')] in changed]
+    new_tag_files = [f for f in tag_files
+                     if f not in st.session_state['tag_dfs_tagger'] or f[0: f.rfind('_')] in changed]
+    new_protein_files = [f for f in protein_files
+                         if f not in st.session_state['protein_dfs_tagger'] or f[0: f.rfind('_')] in changed]
     # new_db_files = [f for f in db_files if f not in st.session_state['protein_db']]
 
     # TODO: Find better solution when enabling file upload
@@ -168,41 +189,53 @@ def parseUploadedFiles(reparse=False):
 
 def parsingWithProgressBar(infiles_deconv, infiles_anno, infiles_tag, infiles_protein):
     successes = []
+    # experiments are parsed in parallel and stored as soon as they are done
+    experiments = [files for files in zip(infiles_anno, infiles_deconv, infiles_tag, infiles_protein)
+                   if files[0].endswith('.mzML')]
     with st.session_state['progress_bar_space']:
-        for anno_f, deconv_f, tag_f, protein_f in zip(infiles_anno, infiles_deconv, infiles_tag, infiles_protein):
-            if not anno_f.endswith('.mzML'):
-                continue
+        progress_bar = st.progress(0, 'Parsing %d experiment(s)...' % len(experiments))
+        parsed_experiments = loadFLASHDeconvOutputs(
+            [(Path(st.session_state["workspace"], "anno-mzMLs", anno_f),
+              Path(st.session_state["workspace"], "deconv-mzMLs", deconv_f)) for anno_f, deconv_f, _, _ in experiments],
+            st.session_state["workspace"], st.session_state.get("lazy-mzML", False)
+        )
+        for n_done, (index, parsed) in enumerate(parsed_experiments, start=1):
+            anno_f, deconv_f, tag_f, protein_f = experiments[index]
             exp_name = anno_f[0: anno_f.rfind('_')]
 
-            with st.spinner('Parsing the experiment %s...'%exp_name):
-                spec_df, anno_df, tolerance, massoffset, chargemass,  = parseFLASHDeconvOutput(
-                    Path(st.session_state["workspace"], "anno-mzMLs", anno_f),
-                    Path(st.session_state["workspace"], "deconv-mzMLs", deconv_f),
-                )
-                tag_df, protein_df = parseFLASHTaggerOutput(
-                    Path(st.session_state["workspace"], "tags-tsv", tag_f),
-                    Path(st.session_state["workspace"], "proteins-tsv", protein_f)
-                    # Path(st.session_state["workspace"], "db-fasta", db_f)
-                )
-                st.session_state['anno_dfs_tagger'][anno_f] = anno_df
-                st.session_state['deconv_dfs_tagger'][deconv_f] = spec_df
-                st.session_state['tag_dfs_tagger'][tag_f] = tag_df
-                # st.session_state['protein_db'][db_f] = db
-                st.session_state['protein_dfs_tagger'][protein_f] = protein_df
+            spec_df, anno_df, peaks, tolerance, massoffset, chargemass,  = parsed
+            tag_df, protein_df = parseFLASHTaggerOutput(
+                Path(st.session_state["workspace"], "tags-tsv", tag_f),
+                Path(st.session_state["workspace"], "proteins-tsv", protein_f)
+                # Path(st.session_state["workspace"], "db-fasta", db_f)
+            )
+            st.session_state['anno_dfs_tagger'][anno_f] = anno_df
+            st.session_state['deconv_dfs_tagger'][deconv_f] = spec_df
+            st.session_state[parsed_peak_type][deconv_f] = peaks
+            st.session_state['tag_dfs_tagger'][tag_f] = tag_df
+            st.session_state[view_model_type][tag_f] = TaggerViewModel(spec_df, tag_df, protein_df)
+            # st.session_state['protein_db'][db_f] = db
+            st.session_state['protein_dfs_tagger'][protein_f] = protein_df
+            recordParsedFiles(st.session_state["workspace"],
+                              [Path(st.session_state["workspace"], dirname, f) for dirname, f in
+                               zip(input_file_types, [deconv_f, anno_f, tag_f, protein_f])])
+            progress_bar.progress(n_done / len(experiments), 'Parsed %d of %d experiment(s)' % (n_done, len(experiments)))
             successes.append(st.success('Done parsing the experiment %s!'%exp_name))
+        progress_bar.empty()
         for success in successes:
             success.empty()
 
 def content():
     # make directory to store deconv and anno mzML files & initialize data storage
     input_types = ["deconv-mzMLs", "anno-mzMLs", "tags-tsv", "proteins-tsv"]
-    parsed_df_types = ["deconv_dfs_tagger", "anno_dfs_tagger", "tag_dfs_tagger", "protein_dfs_tagger"]
+    parsed_df_types = ["deconv_dfs_tagger", "anno_dfs_tagger", "tag_dfs_tagger", "protein_dfs_tagger",
+                       "deconv_peaks_tagger", "tagger_view_models"]
     initializeWorkspace(input_types, parsed_df_types)
 
 
 # for Workflow
 def postprocessingAfterUpload_Tagger(uploaded_files: list) -> None:
-    initializeWorkspace(input_file_types, parsed_df_types)
+    initializeWorkspace(input_file_types, parsed_df_types + [parsed_peak_type, view_model_type])
     #handleInputFiles(uploaded_files)
     parseUploadedFiles(reparse=True)
     showUploadedFilesTable()
@@ -213,7 +246,7 @@ if __name__ == '__main__':
     params = page_setup()
 
     # make directory to store deconv and anno mzML files & initialize data storage
-    initializeWorkspace(input_file_types, parsed_df_types)
+    initializeWorkspace(input_file_types, parsed_df_types + [parsed_peak_type, view_model_type])
 
     st.title("File Upload")
 
@@ -318,7 +351,12 @@ if __name__ == '__main__':
                         reset_directory(Path(st.session_state.workspace, file_option))
                         st.session_state[file_option] = []
                     if df_option in st.session_state:
-                        st.session_state[df_option] = {}
+                        st.session_state[df_option].clear()
+                        if df_option == 'deconv_dfs_tagger':
+                            st.session_state[parsed_peak_type].clear()
+                            reset_directory(Path(st.session_state.workspace, CACHE_DIR_NAME))
+                        elif df_option == 'tag_dfs_tagger':
+                            st.session_state[view_model_type].clear()
 
                         # for k, v in params.items():
                         #     if df_option in k and isinstance(v, list):
@@ -1,6 +1,9 @@
+import multiprocessing
 from streamlit.web import cli
 
 if __name__ == "__main__":
+    # experiments are parsed in (spawned) worker processes, which re-run this script in the frozen executable
+    multiprocessing.freeze_support()
     cli._main_run_clExplicit(
         file="app.py", command_line="streamlit run", args=["local"]
     )  # run in local mode
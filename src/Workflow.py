@@ -384,8 +384,11 @@ class DeconvWorkflow(WorkflowManager):
                 st.session_state['deconv-mzMLs'] = []
             if  'anno-mzMLs' not in st.session_state:
                 st.session_state['anno-mzMLs'] = []
-            st.session_state['deconv-mzMLs'].append(out_deconv.name)
-            st.session_state['anno-mzMLs'].append(out_anno.name)
+            # outputs of earlier runs are already listed, they are only parsed again if they changed
+            if out_deconv.name not in st.session_state['deconv-mzMLs']:
+                st.session_state['deconv-mzMLs'].append(out_deconv.name)
+            if out_anno.name not in st.session_state['anno-mzMLs']:
+                st.session_state['anno-mzMLs'].append(out_anno.name)
 
         # make directory to store deconv and anno mzML files & initialize data storage
         postprocessingAfterUpload_FD(uploaded_files)
@@ -241,6 +241,32 @@ You can share this unique workspace ID with other people.
                 img_formats.index(params["image-format"]),
                 key="image-format",
             )
+            st.checkbox(
+                "lazy spectrum loading",
+                params.get("lazy-mzML", False),
+                key="lazy-mzML",
+                help="Keep only scan-level data of parsed experiments in memory and read peaks from the mzML files "
+                     "when they are shown. Applies to experiments parsed afterwards.",
+            )
+            st.number_input(
+                "memory budget for parsed experiments (MB)",
+                min_value=128,
+                value=params.get("experiment-memory-budget", 2048),
+                step=128,
+                key="experiment-memory-budget",
+                help="Experiments that were not viewed recently are moved from memory to the workspace when "
+                     "this budget is exceeded and loaded again when they are selected. "
+                     "Shared by all sessions of the server.",
+            )
+            st.number_input(
+                "heatmap point limit",
+                min_value=0,
+                value=params.get("heatmap-point-budget", 100000),
+                step=10000,
+                key="heatmap-point-budget",
+                help="Most points drawn by a heatmap, 0 to draw all peaks. Beyond the limit, the peaks are binned "
+                     "on a coarser RT x mass grid (the most intense peak of a bin is drawn).",
+            )
         if (page != "main") and (page != "FLASHViewer"):
             st.info(f"**{Path(st.session_state['workspace']).stem}**")
         st.image("assets/OpenMS.png", "powered by")
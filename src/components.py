@@ -1,13 +1,71 @@
 import os
 import json
+import streamlit as st
 import streamlit.components.v1 as st_components
 
+from src.experimentstore import MemoryCache
+
 # Create a _RELEASE constant. We'll set this to False while we're developing
 # the component, and True when we're ready to package and distribute it.
 _RELEASE = True
 
+# number of serialized grid payloads kept per session
+_PAYLOAD_CACHE_SIZE = 8
+
+# Send the matches of the deconvolved MS2 masses to the fragment ions of the input sequence ('fragment_ions' and
+# 'fragment_matches', see src/fragmentmatch.py) with the sequence view and the internal fragment map.
+# Set this to True only with a component build that annotates the scans from these tables.
+_FRAGMENT_MATCHES = False
+
+
+def sendsFragmentMatches():
+    return _FRAGMENT_MATCHES
+
+
+def serializeData(data):
+    """
+    Serializes the data of the grid into the component arguments.
+
+    Args:
+        data (dict): data frames or dicts per data key
 
-def flash_viewer_grid_component(components, data, component_key='flash_viewer_grid'):
+    Returns:
+        dict: 'data_for_drawing', the data serialized to JSON per data key
+    """
+    data_for_drawing = {}
+    for key, df in data.items():
+        if type(df) is dict:
+            data_for_drawing[key] = json.dumps(df)
+        else:
+            data_for_drawing[key] = df.to_json(orient='records')
+    return dict(data_for_drawing=data_for_drawing)
+
+
+def getCachedPayload(cache_key, get_data):
+    """
+    Serialized grid data for the cache key, from the session cache if the key was seen in one of the
+    last reruns. Otherwise get_data is called to assemble the data, which is then serialized and cached.
+    The cached payloads count towards the memory budget of the parsed experiments.
+
+    Args:
+        cache_key (tuple): everything the data depends on (experiment, its parsed version, layout, settings...)
+        get_data (callable): returns the data of the grid (see flash_viewer_grid_component)
+
+    Returns:
+        dict: serialized data, see serializeData
+    """
+    if 'grid_payloads' not in st.session_state:
+        st.session_state['grid_payloads'] = MemoryCache(_PAYLOAD_CACHE_SIZE)
+    payloads = st.session_state['grid_payloads']
+    payload = payloads.get(cache_key)
+    if payload is None:
+        payload = serializeData(get_data())
+        payloads.put(cache_key, payload, sum(len(serialized) for serialized in payload['data_for_drawing'].values()))
+    return payload
+
+
+def flash_viewer_grid_component(components, data=None, component_key='flash_viewer_grid', payload=None):
+    """ payload: the data already serialized with serializeData (or getCachedPayload), replaces data """
 
     if not _RELEASE:
         _component_func = st_components.declare_component(
@@ -23,17 +81,13 @@ def flash_viewer_grid_component(components, data, component_key='flash_viewer_gr
     for row in components:
         out_components.append(list(map(lambda component: {"componentArgs": component.componentArgs.__dict__}, row)))
 
-    data_for_drawing = {}
-    for key, df in data.items():
-        if type(df) is dict:
-            data_for_drawing[key] = json.dumps(df)
-        else:
-            data_for_drawing[key] = df.to_json(orient='records')
+    if payload is None:
+        payload = serializeData(data)
 
     component_value = _component_func(
         components=out_components,
-        data_for_drawing=data_for_drawing,
-        key=component_key
+        key=component_key,
+        **payload
     )
 
     return component_value
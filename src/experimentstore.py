@@ -0,0 +1,231 @@
+import json
+import uuid
+import logging
+import shutil
+import weakref
+import itertools
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from src.raggedpeaks import RaggedPeaks
+from src.parsecache import CACHE_DIR_NAME, writeFrame, readFrame, writePeaks, readPeaks
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET_MB = 2048
+
+
+def _nbytes(value):
+    """ Approximate memory held by a parsed frame or RaggedPeaks """
+    if isinstance(value, RaggedPeaks):
+        return value.nbytes
+    nbytes = 0
+    for column in value.columns:
+        values = value[column]
+        if values.dtype == object:
+            nbytes += sum(getattr(cell, 'nbytes', 0) for cell in values) + 100 * len(values)
+        else:
+            nbytes += values.to_numpy().nbytes
+    return nbytes
+
+
+class _MemoryPool:
+    """
+    Least recently used in-memory entries of all experiment stores (and memory caches) of the server process.
+    When their size exceeds the budget, the oldest entries are spilled to disk (or dropped) by their store.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.lock = threading.RLock()
+        self._entries = OrderedDict()  # (store id, key) -> bytes
+        self._stores = weakref.WeakValueDictionary()  # store id -> store
+        self._total = 0
+
+    def touch(self, store, key, nbytes=None):
+        with self.lock:
+            entry = (store.id, key)
+            if nbytes is None:
+                self._entries.move_to_end(entry)
+                return
+            self._total += nbytes - self._entries.pop(entry, 0)
+            self._entries[entry] = nbytes
+            self._stores[store.id] = store
+            self._evict(keep=entry)
+
+    def forget(self, store, key):
+        with self.lock:
+            self._total -= self._entries.pop((store.id, key), 0)
+
+    def _evict(self, keep):
+        # oldest first, the entry in use is never spilled. Entries that can not be spilled stay in memory
+        for entry in [entry for entry in self._entries if entry != keep]:
+            if self._total <= self.budget:
+                return
+            store_id, key = entry
+            store = self._stores.get(store_id)
+            if store is None or store._spill(key):
+                self._total -= self._entries.pop(entry)
+
+
+_pool = _MemoryPool(DEFAULT_MEMORY_BUDGET_MB << 20)
+_versions = itertools.count(1)
+
+
+def setMemoryBudget(budget_mb):
+    """ Sets the memory budget shared by all experiment stores, in MB """
+    with _pool.lock:
+        _pool.budget = int(budget_mb) << 20
+        _pool._evict(keep=None)
+
+
+class ExperimentStore(MutableMapping):
+    """
+    Dictionary of parsed experiment data (frames or RaggedPeaks) keyed by file name, that keeps only the
+    recently used entries in memory. Entries beyond the memory budget are written to disk column by column
+    and loaded again (memory mapped) when they are accessed.
+
+    Attributes:
+        id (str): identifier of the store
+        directory (Path): where the spilled entries of this store are written
+    """
+
+    def __init__(self, workspace):
+        self.id = uuid.uuid4().hex
+        self.directory = Path(workspace, CACHE_DIR_NAME, 'spill', self.id)
+        self._memory = {}
+        self._spilled = {}  # key -> sub directory, valid until the key is set again
+        self._keys = {}  # insertion ordered keys -> version, unique in the process and new whenever a key is set
+        weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def __getitem__(self, key):
+        with _pool.lock:
+            if key in self._memory:
+                _pool.touch(self, key)
+                return self._memory[key]
+            if key not in self._spilled:
+                raise KeyError(key)
+            value = self._load(self._spilled[key])
+            self._memory[key] = value
+            _pool.touch(self, key, _nbytes(value))
+            return value
+
+    def __setitem__(self, key, value):
+        with _pool.lock:
+            self._drop(key)
+            self._keys.pop(key, None)
+            self._keys[key] = next(_versions)
+            self._memory[key] = value
+            _pool.touch(self, key, _nbytes(value))
+
+    def __delitem__(self, key):
+        with _pool.lock:
+            if key not in self._keys:
+                raise KeyError(key)
+            self._drop(key)
+            del self._keys[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def getVersion(self, key):
+        """ Version of the entry: changes whenever it is set again, e.g. after the experiment is parsed again """
+        return self._keys[key]
+
+    def clear(self):
+        # without loading the spilled entries like MutableMapping.clear does
+        with _pool.lock:
+            for key in list(self._keys):
+                del self[key]
+
+    def _drop(self, key):
+        self._memory.pop(key, None)
+        _pool.forget(self, key)
+        directory = self._spilled.pop(key, None)
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _spill(self, key):
+        """ Moves an entry from memory to disk, returns False if it could not be written (it stays in memory) """
+        if key not in self._spilled:  # otherwise unchanged since it was spilled
+            value = self._memory[key]
+            directory = Path(self.directory, uuid.uuid4().hex)
+            try:
+                directory.mkdir(parents=True)
+                if isinstance(value, RaggedPeaks):
+                    writePeaks(value, directory)
+                    meta = {'kind': 'peaks'}
+                else:
+                    meta = {'kind': 'frame', 'columns': writeFrame(value, directory)}
+                with open(Path(directory, 'meta.json'), 'w') as f:
+                    json.dump(meta, f)
+            except OSError as error:
+                logger.warning('Could not spill %s to %s, it is kept in memory: %s', key, directory, error)
+                shutil.rmtree(directory, ignore_errors=True)
+                return False
+            self._spilled[key] = directory
+        del self._memory[key]
+        return True
+
+    @staticmethod
+    def _load(directory):
+        with open(Path(directory, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta['kind'] == 'peaks':
+            return readPeaks(directory)
+        return readFrame(meta['columns'], directory)
+
+
+class MemoryCache:
+    """
+    Least recently used values that can be computed again (e.g. serialized viewer data), charged to the memory
+    budget of the experiment stores. Values beyond the budget or beyond max_entries are dropped instead of spilled.
+
+    Attributes:
+        id (str): identifier of the cache
+        max_entries (int): maximum number of values, None for no limit
+    """
+
+    def __init__(self, max_entries=None):
+        self.id = uuid.uuid4().hex
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+
+    def get(self, key):
+        """ The value of the key, None if it is not cached """
+        with _pool.lock:
+            if key not in self._values:
+                return None
+            self._values.move_to_end(key)
+            _pool.touch(self, key)
+            return self._values[key]
+
+    def put(self, key, value, nbytes):
+        """ Caches the value of the key, nbytes is the memory it holds """
+        with _pool.lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            _pool.touch(self, key, nbytes)
+            while self.max_entries is not None and len(self._values) > self.max_entries:
+                oldest = next(iter(self._values))
+                del self._values[oldest]
+                _pool.forget(self, oldest)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def _spill(self, key):
+        self._values.pop(key, None)
+        return True
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from src.sequence import getFragmentArrays, getInternalFragmentArrays
+
+
+TERMINAL_ION_TYPES = 'abcxyz'
+INTERNAL_ION_TYPES = ('by', 'bz', 'cy')
+DEFAULT_TOLERANCE_PPM = 10
+
+
+class FragmentIndex:
+    """
+    Theoretical fragment ions (terminal and internal) of a proteoform sorted by mass, to look up the ions
+    matching observed (deconvolved) masses.
+
+    Attributes:
+        masses (np.ndarray): float64, sorted neutral masses of the ions, the id of an ion is its position here
+        ions (pd.DataFrame): per ion id 'mass', 'ion_type' and the residues [start, end) of the fragment
+    """
+
+    def __init__(self, sequence, fixed_mods=(None, None), ion_types=TERMINAL_ION_TYPES,
+                 internal_ion_types=INTERNAL_ION_TYPES, workspace=None):
+        length = len(sequence)
+        fragment_lengths = np.arange(1, length + 1)
+        masses, ion_types_of_ions, starts, ends = [], [], [], []
+
+        terminal = getFragmentArrays(sequence, tuple(fixed_mods), ion_types, workspace)
+        for ion_type in ion_types:
+            is_prefix = ion_type in 'abc'
+            masses.append(terminal['fragment_masses_%s' % ion_type])
+            ion_types_of_ions.append(np.full(length, ion_type))
+            starts.append(np.zeros(length, dtype=np.int64) if is_prefix else length - fragment_lengths)
+            ends.append(fragment_lengths if is_prefix else np.full(length, length))
+
+        if len(internal_ion_types):
+            internal = getInternalFragmentArrays(sequence, tuple(internal_ion_types), workspace)
+            for ion_type in internal_ion_types:
+                ion_masses = internal['fragment_masses_%s' % ion_type]
+                masses.append(ion_masses)
+                ion_types_of_ions.append(np.full(len(ion_masses), ion_type))
+                starts.append(internal['start_indices_%s' % ion_type])
+                ends.append(internal['end_indices_%s' % ion_type])
+
+        masses = np.concatenate(masses).astype(np.float64)
+        order = np.argsort(masses, kind='stable')
+        self.masses = masses[order]
+        index_type = np.int16 if length <= np.iinfo(np.int16).max else np.int32
+        self.ions = pd.DataFrame({'mass': self.masses,
+                                  'ion_type': pd.Categorical(np.concatenate(ion_types_of_ions)[order]),
+                                  'start': np.concatenate(starts)[order].astype(index_type),
+                                  'end': np.concatenate(ends)[order].astype(index_type)})
+
+    def __len__(self):
+        return len(self.masses)
+
+    def match(self, observed, tolerance=DEFAULT_TOLERANCE_PPM, unit='ppm'):
+        """
+        All (observed mass, ion) pairs within the tolerance.
+
+        Args:
+            observed (array-like): observed neutral masses
+            tolerance (float): mass tolerance, on each side
+            unit (str): 'ppm' (relative to the observed mass) or 'Da'
+
+        Returns:
+            np.ndarray: index of the observed mass of every match
+            np.ndarray: id of the matched ion (row of ions)
+            np.ndarray: observed minus theoretical mass, in the unit of the tolerance
+        """
+        observed = np.asarray(observed, dtype=np.float64)
+        if unit == 'ppm':
+            widths = observed * tolerance * 1e-6
+        elif unit == 'Da':
+            widths = np.full(len(observed), float(tolerance))
+        else:
+            raise ValueError('Unknown tolerance unit %s, expected ppm or Da' % unit)
+
+        lower = np.searchsorted(self.masses, observed - widths, side='left')
+        upper = np.searchsorted(self.masses, observed + widths, side='right')
+        counts = upper - lower
+        mass_indices = np.repeat(np.arange(len(observed)), counts)
+        # ions lower[i], ..., upper[i] - 1 for every observed mass i
+        ion_ids = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lower, counts)
+        errors = observed[mass_indices] - self.masses[ion_ids]
+        if unit == 'ppm':
+            errors = errors / self.masses[ion_ids] * 1e6
+        return mass_indices, ion_ids, errors
+
+
+def matchScans(fragment_index, mass_arrays, scans, tolerance=DEFAULT_TOLERANCE_PPM, unit='ppm'):
+    """
+    Matches the deconvolved masses of many scans to the fragment ions at once.
+
+    Args:
+        fragment_index (FragmentIndex): ions of the proteoform
+        mass_arrays (list): deconvolved masses (np.ndarray) of every scan
+        scans (array-like): scan number of every mass array
+        tolerance (float): mass tolerance, on each side
+        unit (str): 'ppm' or 'Da'
+
+    Returns:
+        pd.DataFrame: one row per match, 'Scan', 'MassIndex' (index of the mass in the scan), 'IonId' (row of
+                      fragment_index.ions) and 'Error' (in the unit of the tolerance), ordered by scan and mass
+    """
+    counts = np.array([len(masses) for masses in mass_arrays], dtype=np.int64)
+    observed = np.concatenate(list(mass_arrays)) if len(mass_arrays) else np.zeros(0)
+    mass_indices, ion_ids, errors = fragment_index.match(observed, tolerance, unit)
+    scan_of_mass = np.repeat(np.arange(len(counts)), counts)
+    first_mass = np.cumsum(counts) - counts
+    scan_positions = scan_of_mass[mass_indices]
+    return pd.DataFrame({
+        'Scan': np.asarray(scans, dtype=np.int32)[scan_positions],
+        'MassIndex': (mass_indices - first_mass[scan_positions]).astype(np.int32),
+        'IonId': ion_ids.astype(np.int32),
+        'Error': errors,
+    })
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+class HeatmapPyramid:
+    """
+    RT x mass binning of the peaks of an experiment at several resolutions, so that a heatmap gets
+    at most a fixed number of points.
+
+    Level 0 has the finest bins, each following level merges 2 x 2 bins of the previous one, the last level
+    has a single bin. Every level only keeps its non-empty bins, drawn at their center.
+
+    Attributes:
+        points (pd.DataFrame): all peaks, 'mass', 'rt' and 'intensity' columns
+        levels (list): per level 'mass', 'rt' and 'intensity' arrays of the non-empty bins
+        aggregation (str): 'max' or 'sum' intensity of the peaks in a bin
+    """
+
+    def __init__(self, points, rt_bins=2048, mass_bins=8192, aggregation='max'):
+        self.points = points
+        self.aggregation = aggregation
+        self.levels = []
+
+        rts = points['rt'].to_numpy()
+        masses = points['mass'].to_numpy()
+        intensities = points['intensity'].to_numpy()
+        if len(points) == 0:
+            return
+        rt_min, rt_max = rts.min(), rts.max()
+        mass_min, mass_max = masses.min(), masses.max()
+        rt_width = max(rt_max - rt_min, 1e-9) / rt_bins
+        mass_width = max(mass_max - mass_min, 1e-9) / mass_bins
+
+        rt_ids = np.minimum(((rts - rt_min) / rt_width).astype(np.int64), rt_bins - 1)
+        mass_ids = np.minimum(((masses - mass_min) / mass_width).astype(np.int64), mass_bins - 1)
+        while True:
+            rt_ids, mass_ids, intensities = self._aggregate(rt_ids, mass_ids, intensities)
+            self.levels.append({'rt': rt_min + (rt_ids + 0.5) * rt_width,
+                                'mass': mass_min + (mass_ids + 0.5) * mass_width,
+                                'intensity': intensities})
+            if len(intensities) == 1:
+                break
+            rt_ids, mass_ids = rt_ids // 2, mass_ids // 2
+            rt_width, mass_width = rt_width * 2, mass_width * 2
+
+    def _aggregate(self, rt_ids, mass_ids, intensities):
+        bin_ids = rt_ids * (mass_ids.max() + 1) + mass_ids
+        order = np.argsort(bin_ids, kind='stable')
+        bin_ids = bin_ids[order]
+        starts = np.flatnonzero(np.concatenate([[True], bin_ids[1:] != bin_ids[:-1]]))
+        reduce = np.maximum if self.aggregation == 'max' else np.add
+        return rt_ids[order][starts], mass_ids[order][starts], reduce.reduceat(intensities[order], starts)
+
+    @property
+    def nbytes(self):
+        return self.points.memory_usage(index=False).sum() + sum(values.nbytes for level in self.levels
+                                                                 for values in level.values())
+
+    def query(self, budget):
+        """
+        Points of the heatmap: the peaks themselves if there are no more than budget of them,
+        otherwise the bins of the finest level that fits the budget.
+
+        Args:
+            budget (int): maximum number of returned points, at least 1
+
+        Returns:
+            pd.DataFrame: 'mass', 'rt' and 'intensity' columns, sorted by intensity
+        """
+        level = {'mass': self.points['mass'].to_numpy(), 'rt': self.points['rt'].to_numpy(),
+                 'intensity': self.points['intensity'].to_numpy()}
+        for coarser in self.levels:
+            if len(level['intensity']) <= budget:
+                break
+            level = coarser
+
+        indices = np.argsort(level['intensity'], kind='stable')
+        return pd.DataFrame({'mass': level['mass'][indices], 'rt': level['rt'][indices],
+                             'intensity': level['intensity'][indices]})
@@ -0,0 +1,96 @@
+import threading
+import pandas as pd
+import streamlit as st
+from pathlib import Path
+from pyopenms import OnDiscMSExperiment
+
+from src.parsecache import getFileStamp
+
+
+class OnDiscSpectra:
+    """
+    Read-only access to the spectra of an indexed mzML file without loading its peaks into memory.
+
+    Opening the file only reads the spectrum byte-offset index (and the meta data of all spectra),
+    the peaks of a spectrum are read from disk when they are requested. The file handle is shared:
+    reads are serialized, so one instance can be used by several sessions.
+
+    Attributes:
+        path (Path): the mzML file
+        meta_data (MSExperiment): all spectra with their meta values, without peaks
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._exp = OnDiscMSExperiment()
+        self._lock = threading.Lock()
+        if not self._exp.openFile(str(self.path)):
+            raise ValueError('%s is not an indexed mzML file.' % self.path.name)
+        self.meta_data = self._exp.getMetaData()
+
+    def __len__(self):
+        return self._exp.getNrSpectra()
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.getSpectrum(index)
+
+    def getSpectrum(self, index):
+        """ Spectrum with peaks and meta values, read from disk """
+        with self._lock:
+            return self._exp.getSpectrum(index)
+
+    def getSourceFiles(self):
+        return self.meta_data.getSourceFiles()
+
+    def getPeaks(self, index):
+        """ m/z and intensity arrays of a spectrum, sorted by m/z """
+        spec = self.getSpectrum(index)
+        spec.sortByPosition()
+        return spec.get_peaks()
+
+    def getPeakColumns(self, indices):
+        """
+        Peaks of the given spectra, in the 'mzarray' and 'intarray' columns of the parsed frames.
+
+        Args:
+            indices (list): spectrum indices, one per row of the returned frame
+
+        Returns:
+            pd.DataFrame: 'mzarray' and 'intarray' columns with one array per spectrum
+        """
+        peaks = [self.getPeaks(index) for index in indices]
+        return pd.DataFrame({'mzarray': pd.Series([p[0] for p in peaks], index=indices, dtype=object),
+                             'intarray': pd.Series([p[1] for p in peaks], index=indices, dtype=object)})
+
+
+@st.cache_resource(max_entries=16)
+def _openOnDiscSpectra(path, stamp):
+    # one open handle (and index) per file version, shared by all sessions
+    return OnDiscSpectra(path)
+
+
+def getOnDiscSpectra(path):
+    """ OnDiscSpectra of an indexed mzML file, opened again when the file is modified """
+    stamp = getFileStamp(path)
+    return _openOnDiscSpectra(str(path), None if stamp is None else tuple(stamp))
+
+
+def withPeakColumns(df, path, rows=None):
+    """
+    Rows of a parsed frame with their 'mzarray' and 'intarray' columns. If the frame was parsed in lazy mode
+    (only scan-level columns are kept in memory), the peaks of these rows only are read from disk.
+
+    Args:
+        df (pd.DataFrame): parsed frame, labelled by spectrum index
+        path (Path): mzML file the frame was parsed from
+        rows (array-like): labels of the rows to return, None for all rows
+
+    Returns:
+        pd.DataFrame: the rows with their peak columns
+    """
+    if rows is not None:
+        df = df.loc[rows]
+    if 'mzarray' in df.columns:
+        return df
+    return pd.concat([df, getOnDiscSpectra(path).getPeakColumns(list(df.index))], axis=1)
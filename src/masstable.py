@@ -1,181 +1,434 @@
+import os
+import re
+import shutil
+import logging
 import streamlit as st
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from pyopenms import MSExperiment, MzMLFile, SpectrumLookup, Constants
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pyopenms import MSExperiment, MzMLFile, Constants
+from src.raggedpeaks import RaggedPeaks
+from src.lazymzml import OnDiscSpectra
+from src.scanindex import ScanIndex, extractScanNumbers
+from src.heatmappyramid import HeatmapPyramid
+from src.experimentstore import MemoryCache
+from src.parsecache import getCacheKey, getCacheDir, getFileStamp, readParsedOutput, writeParsedOutput
 
 
-@st.cache_data
-def parseFLASHDeconvOutput(annotated, deconvolved):
-    annotated_exp = MSExperiment()
-    deconvolved_exp = MSExperiment()
-    MzMLFile().load(str(Path(annotated)), annotated_exp)
-    MzMLFile().load(str(Path(deconvolved)), deconvolved_exp)
-    tolerance = .0
-    massoffset = .0
-    chargemass = .0
-
-    df = deconvolved_exp.get_df()
-    annotateddf = annotated_exp.get_df()
-    allPeaks = []
-    signalPeaks = []
-    noisyPeaks = []
-    minCharges=[]
-    maxCharges=[]
-    minIsotopes=[]
-    maxIsotopes=[]
-    scoreMaps={}
-    msLevels=[]
-    precursorMasses=[]
-    precursorScans=[]
-    scans=[]
-
-    for spec, aspec in zip(deconvolved_exp, annotated_exp):
-        spec.sortByPosition()
-        aspec.sortByPosition()
-
-        mstr = spec.getMetaValue('DeconvMassInfo')
-        #tol=0;massoffset=0.000000;chargemass=1.007276;scorenames=cos,snr,qscore,qvalue;peaks=2:2,0:4,0.998392:3.97592:0.828587:1;
-        # Split the string into key-value pairs
-        input_pairs = mstr.split(';')
-
-        # Create a dictionary to store the parsed values
-        parsed_dict = {}
-        scoremap = {}
-        # Parse the key-value pairs and store them in the dictionary
-        for pair in input_pairs:
-            if len(pair) == 0:
+logger = logging.getLogger(__name__)
+
+# bump whenever the output of parseFLASHDeconvOutput changes: invalidates the parse cache of every workspace
+PARSER_VERSION = 3
+
+# points drawn by a heatmap unless set otherwise, see getHeatmapDF
+DEFAULT_HEATMAP_BUDGET = 100000
+
+# heatmap pyramids of all sessions, see getHeatmapDF
+_heatmap_pyramids = MemoryCache()
+
+# key of each 'key=value' field in a DeconvMassInfo meta string (the 'peaks' value itself contains ';')
+_DECONV_INFO_KEY = re.compile(r'(?:^|;)(\w+)=')
+_DECONV_INFO_HEADER = ('tol', 'massoffset', 'chargemass')
+
+
+def parseDeconvMassInfo(mass_infos):
+    """
+    Parses the 'DeconvMassInfo' meta strings of all spectra in one pass.
+
+    Per-mass values of all spectra are tokenized together into flat NumPy arrays,
+    the masses of spectrum i are found at [offsets[i], offsets[i+1]).
+
+    Parameters:
+    mass_infos (list of str): DeconvMassInfo meta value of each deconvolved spectrum
+
+    Returns:
+    dict: 'MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes' (per mass), 'scores' (score name -> per mass),
+          'PrecursorScan', 'PrecursorMass' (per spectrum), 'offsets' and the 'tol', 'massoffset', 'chargemass' header
+    """
+    #tol=5;massoffset=0.000000;chargemass=1.007276;precursorscan=0;precursormass=42489.927236;peaks=1:1,0:1;1:1,0:2;cos=0.997121,0.997365,;...
+    header = {key: .0 for key in _DECONV_INFO_HEADER}
+    precursor_scans = np.zeros(len(mass_infos))
+    precursor_masses = np.zeros(len(mass_infos))
+    mass_counts = np.zeros(len(mass_infos), dtype=np.int64)
+    peak_strs = []
+    score_strs = {}
+    for spec_index, mstr in enumerate(mass_infos):
+        fields = list(_DECONV_INFO_KEY.finditer(mstr))
+        for field_index, field in enumerate(fields):
+            value_end = fields[field_index + 1].start() if field_index + 1 < len(fields) else len(mstr)
+            key, value = field.group(1), mstr[field.end():value_end]
+            if key == 'peaks':
+                value = value.strip(';')
+                if value:
+                    peak_strs.append(value)
+                    mass_counts[spec_index] = value.count(';') + 1
+            elif key == 'precursorscan':
+                precursor_scans[spec_index] = float(value)
+            elif key == 'precursormass':
+                precursor_masses[spec_index] = float(value)
+            elif ',' in value:  # scores
+                score_strs.setdefault(key, []).append((spec_index, value.strip(';').strip(',')))
+            elif value:
+                header[key] = float(value)
+
+    # every mass has 'minCharge:maxCharge,minIsotope:maxIsotope'
+    peak_values = ','.join(peak_strs).replace(':', ',').replace(';', ',')
+    peak_values = np.fromstring(peak_values, dtype=np.int64, sep=',') if peak_values else np.zeros(0, dtype=np.int64)
+    peak_values = peak_values.reshape(-1, 4)
+    if len(peak_values) != mass_counts.sum():
+        raise ValueError('DeconvMassInfo peaks do not match the number of masses.')
+
+    # the scores of all spectra are concatenated: every spectrum must have exactly one score per mass
+    scores = {}
+    for key, values in score_strs.items():
+        score_counts = np.zeros(len(mass_infos), dtype=np.int64)
+        for spec_index, value in values:
+            score_counts[spec_index] = value.count(',') + 1
+        mismatch = np.flatnonzero(score_counts != mass_counts)
+        if len(mismatch):
+            raise ValueError('DeconvMassInfo score %s of spectrum %d has %d values for %d masses.'
+                             % (key, mismatch[0], score_counts[mismatch[0]], mass_counts[mismatch[0]]))
+        scores[key] = np.fromstring(','.join(value for _, value in values), dtype=float, sep=',')
+        if len(scores[key]) != mass_counts.sum():
+            raise ValueError('DeconvMassInfo score %s has values that are not numbers.' % key)
+
+    out = {'MinCharges': peak_values[:, 0],
+           'MaxCharges': peak_values[:, 1],
+           'MinIsotopes': peak_values[:, 2],
+           'MaxIsotopes': peak_values[:, 3],
+           'scores': scores,
+           'PrecursorScan': precursor_scans,
+           'PrecursorMass': precursor_masses,
+           'offsets': np.concatenate([[0], np.cumsum(mass_counts)])}
+    out.update(header)
+    return out
+
+
+def parseDeconvMassPeakIndices(mstr):
+    """
+    Parses the 'DeconvMassPeakIndices' meta string of an annotated spectrum.
+
+    Parameters:
+    mstr (str): e.g. '451.243454:212,213,214;466.204915:287,288;'
+
+    Returns:
+    tuple: masses, and (mass index, peak index) of every signal peak
+    """
+    tokens = re.split('[;:]', mstr.strip(';'))
+    if len(tokens) < 2:
+        return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    masses = np.array(tokens[0::2], dtype=float)
+    index_strs = tokens[1::2]
+    counts = [index_str.count(',') + 1 if index_str else 0 for index_str in index_strs]
+    index_values = ','.join(filter(None, index_strs))
+    peak_ids = np.fromstring(index_values, dtype=np.int64, sep=',') if index_values else np.zeros(0, dtype=np.int64)
+    return masses, np.repeat(np.arange(len(masses)), counts), peak_ids
+
+
+def _rangeIndices(starts, counts):
+    # expands [starts[i], starts[i] + counts[i]) ranges into (range index, value) arrays
+    range_ids = np.repeat(np.arange(len(counts)), counts)
+    values = np.arange(len(range_ids)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+    return range_ids, values
+
+
+def assignPeaksToMasses(mzs, masses, min_charges, max_charges, max_isotopes):
+    """
+    Finds the peaks of a (sorted) spectrum within the charge windows of each deconvolved mass.
+
+    For every mass and charge z in [min charge, max charge] the window starts at the peak nearest to
+    (mass - 3)/z + proton and ends at (mass + 3 + max isotope * C13C12)/z + proton. Only the peaks
+    with round(mass/mz) == z are kept.
+
+    Returns:
+    tuple: mass index and peak index of every assigned peak, ordered by mass, charge and m/z
+    """
+    charge_counts = np.maximum(max_charges - min_charges + 1, 0)
+    pair_mass_ids, pair_charges = _rangeIndices(min_charges, charge_counts)
+    if len(mzs) == 0 or len(pair_mass_ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    pair_masses = masses[pair_mass_ids]
+    min_mzs = (pair_masses - 3.0)/pair_charges + Constants.PROTON_MASS_U
+    max_mzs = (pair_masses + 3.0 + max_isotopes[pair_mass_ids] * Constants.C13C12_MASSDIFF_U)/pair_charges \
+              + Constants.PROTON_MASS_U
+
+    # same as MSSpectrum.findNearest: on a tie, the lower peak wins
+    right = np.searchsorted(mzs, min_mzs, side='left')
+    left = np.maximum(right - 1, 0)
+    right = np.minimum(right, len(mzs) - 1)
+    first = np.where(np.abs(mzs[right] - min_mzs) < np.abs(mzs[left] - min_mzs), right, left)
+    last = np.maximum(np.searchsorted(mzs, max_mzs, side='right'), first)
+
+    pair_ids, peak_ids = _rangeIndices(first, last - first)
+    keep = np.round(pair_masses[pair_ids] / mzs[peak_ids]) == pair_charges[pair_ids]
+    return pair_mass_ids[pair_ids[keep]], peak_ids[keep]
+
+
+def _raggedColumn(values, offsets, index):
+    # one array view per spectrum, wrapped in a Series so that pandas does not broadcast equal-length arrays
+    return pd.Series(np.split(values, offsets[1:-1]) if len(index) else [], index=index, dtype=object)
+
+
+def _openSpectra(path):
+    """ Spectra of an mzML file with their meta data, read from disk if the file is indexed """
+    try:
+        spectra = OnDiscSpectra(path)
+        return spectra, spectra.meta_data
+    except ValueError:
+        # not indexed: the whole file is loaded into memory
+        spectra = MSExperiment()
+        MzMLFile().load(str(Path(path)), spectra)
+        return spectra, spectra
+
+
+def _sortedPeaks(spectra, index):
+    spec = spectra.getSpectrum(index)
+    spec.sortByPosition()
+    return spec.get_peaks()
+
+
+def parseFLASHDeconvOutput(annotated, deconvolved, lazy=False):
+    # not memoized: loadFLASHDeconvOutput keys the parsed output on the content of the files
+    # one pass over the spectrum pairs: only the peaks of the current pair are read, all columns are filled at once
+    # in lazy mode the frames only get the scan-level columns, the viewers read the peaks from disk
+    annotated_exp, annotated_meta = _openSpectra(annotated)
+    deconvolved_exp, deconvolved_meta = _openSpectra(deconvolved)
+    if lazy and not (isinstance(annotated_exp, OnDiscSpectra) and isinstance(deconvolved_exp, OnDiscSpectra)):
+        # the peaks can only be read on demand from indexed files
+        logger.warning('%s or %s is not an indexed mzML file, its peaks are kept in memory',
+                       Path(annotated).name, Path(deconvolved).name)
+        lazy = False
+    sourcefiles = annotated_meta.getSourceFiles()
+
+    mass_info = parseDeconvMassInfo([spec.getMetaValue('DeconvMassInfo') for spec in deconvolved_meta])
+    tolerance = mass_info['tol']
+    massoffset = mass_info['massoffset']
+    chargemass = mass_info['chargemass']
+    offsets = mass_info['offsets']
+
+    peak_columns = [] if lazy else ['mzarray', 'intarray']
+    columns = {name: [] for name in ['RT'] + peak_columns}
+    anno_columns = {name: [] for name in ['RT'] + peak_columns}
+    scanPeaks = []
+    msLevels = []
+    nativeIDs = []
+    for spec_index, (spec, aspec) in enumerate(zip(deconvolved_meta, annotated_meta)):
+        begin, end = offsets[spec_index], offsets[spec_index + 1]
+        masses, mass_intensities = _sortedPeaks(deconvolved_exp, spec_index)
+        mzs, intensities = _sortedPeaks(annotated_exp, spec_index)
+        mass_ids, peak_ids = assignPeaksToMasses(mzs, masses,
+                                                 mass_info['MinCharges'][begin:end],
+                                                 mass_info['MaxCharges'][begin:end],
+                                                 mass_info['MaxIsotopes'][begin:end])
+
+        # signal peaks are the ones FLASHDeconv used for each mass, all the other peaks in the windows are noisy
+        peak_masses, signal_mass_ids, signal_peak_ids = parseDeconvMassPeakIndices(
+            aspec.getMetaValue('DeconvMassPeakIndices'))
+        is_signal = np.isin(mass_ids * len(mzs) + peak_ids, signal_mass_ids * len(mzs) + signal_peak_ids)
+        charges = np.round(peak_masses[mass_ids] / mzs[peak_ids]).astype(int)
+        scanPeaks.append((len(peak_masses), mass_ids, peak_ids, mzs[peak_ids], intensities[peak_ids],
+                          charges, is_signal))
+
+        nativeIDs.append(aspec.getNativeID())
+        msLevels.append(aspec.getMSLevel())
+
+        columns['RT'].append(spec.getRT())
+        anno_columns['RT'].append(aspec.getRT())
+        if not lazy:
+            columns['mzarray'].append(masses)
+            columns['intarray'].append(mass_intensities)
+            anno_columns['mzarray'].append(mzs)
+            anno_columns['intarray'].append(intensities)
+
+    df = pd.DataFrame({k: pd.Series(v, dtype=object if k in peak_columns else float) for k, v in columns.items()})
+    annotateddf = pd.DataFrame({k: pd.Series(v, dtype=object if k in peak_columns else float)
+                                for k, v in anno_columns.items()})
+
+    for column in ['MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes']:
+        df[column] = _raggedColumn(mass_info[column], offsets, df.index)
+    df['PrecursorScan'] = mass_info['PrecursorScan']
+    df['PrecursorMass'] = mass_info['PrecursorMass']
+
+    for k, scores in mass_info['scores'].items():
+        df[k] = _raggedColumn(scores, offsets, df.index)
+
+    df['MSLevel'] = msLevels
+    scan_index = ScanIndex(extractScanNumbers(
+        nativeIDs, sourcefiles[0].getNativeIDTypeAccession() if sourcefiles else None))
+    df['Scan'] = scan_index.scans
+    # spectrum index of the precursor scan, -1 if it is not in the file
+    df['PrecursorIndex'] = scan_index.indexOf(df['PrecursorScan'].astype(np.int64))
+
+    return df, annotateddf, RaggedPeaks.fromScans(scanPeaks), tolerance,  massoffset, chargemass
+
+
+def _parsedOutputDir(workspace, deconvolved, lazy):
+    return getCacheDir(workspace, Path(deconvolved).stem + ('-lazy' if lazy else ''))
+
+
+def removeParsedOutput(workspace, deconvolved):
+    """ Removes the parsed output of a deconvolved file, in both parse modes, from the parse cache of the workspace """
+    for lazy in (False, True):
+        shutil.rmtree(_parsedOutputDir(workspace, deconvolved, lazy), ignore_errors=True)
+
+
+def _loadParsedOutput(annotated, deconvolved, workspace, lazy):
+    # parsed output and whether it is stored in the parse cache
+    cache_dir = _parsedOutputDir(workspace, deconvolved, lazy)
+    # taken before hashing: a file modified while it is parsed is hashed again on the next load
+    stamps = [getFileStamp(annotated), getFileStamp(deconvolved)]
+    key = getCacheKey([annotated, deconvolved], PARSER_VERSION, cache_dir)
+    parsed = readParsedOutput(cache_dir, key)
+    if parsed is not None:
+        return parsed, True
+
+    parsed = parseFLASHDeconvOutput(annotated, deconvolved, lazy)
+    try:
+        writeParsedOutput(cache_dir, key, *parsed, stamps=stamps)
+    except OSError as error:
+        # the cache is optional, the parsed output is still valid
+        logger.warning('Could not store the parsed output of %s in %s: %s', deconvolved, cache_dir, error)
+        return parsed, False
+    return parsed, True
+
+
+def loadFLASHDeconvOutput(annotated, deconvolved, workspace, lazy=False):
+    """
+    Same as parseFLASHDeconvOutput, but reuses the parsed output stored in the parse cache of the workspace
+    if the input files and the parser did not change.
+
+    Args:
+        annotated (Path): annotated mzML file
+        deconvolved (Path): deconvolved mzML file
+        workspace (Path): workspace the parsed output is stored in
+        lazy (bool): parse in lazy mode
+    """
+    return _loadParsedOutput(annotated, deconvolved, workspace, lazy)[0]
+
+
+def _loadInWorker(annotated, deconvolved, workspace, lazy):
+    # runs in a worker process: the parsed output is only sent back if it could not be stored in the parse cache,
+    # otherwise the caller memory maps it from there
+    parsed, cached = _loadParsedOutput(annotated, deconvolved, workspace, lazy)
+    return None if cached else parsed
+
+
+def loadFLASHDeconvOutputs(experiments, workspace, lazy=False, max_workers=None):
+    """
+    Parses several experiments with loadFLASHDeconvOutput, each one in its own worker process.
+
+    Args:
+        experiments (list): (annotated, deconvolved) file pairs
+        workspace (Path): workspace the parsed outputs are stored in
+        lazy (bool): parse in lazy mode
+        max_workers (int): number of worker processes, defaults to the number of CPUs
+
+    Yields:
+        tuple: index of the experiment in experiments and its parsed output, as soon as it is parsed
+    """
+    max_workers = min(len(experiments), max_workers or os.cpu_count() or 1)
+    if max_workers <= 1:
+        for index, (annotated, deconvolved) in enumerate(experiments):
+            yield index, loadFLASHDeconvOutput(annotated, deconvolved, workspace, lazy)
+        return
+
+    # 'spawn' does not copy the state of the (multi-threaded) streamlit server into the workers
+    with ProcessPoolExecutor(max_workers, mp_context=get_context('spawn')) as executor:
+        futures = {executor.submit(_loadInWorker, annotated, deconvolved, workspace, lazy): index
+                   for index, (annotated, deconvolved) in enumerate(experiments)}
+        for future in as_completed(futures):
+            parsed = future.result()  # re-raises errors of the worker
+            if parsed is None:
+                annotated, deconvolved = experiments[futures[future]]
+                parsed = loadFLASHDeconvOutput(annotated, deconvolved, workspace, lazy)
+            yield futures[future], parsed
+
+
+# per-protein columns of a tag matching several proteins hold ';' separated values
+_TAG_NUMERIC_COLUMNS = {'ProteinIndex': 'int64', 'StartPos': 'int64', 'DeltaMass': 'float64'}
+
+
+def explodeTagDF(tag_df):
+    """
+    One row per (tag, protein): tags matching several proteins are split into one row per protein,
+    tags matching no protein are dropped.
+
+    Args:
+        tag_df (pd.DataFrame): tags as written by FLASHTagger
+
+    Returns:
+        pd.DataFrame: tags with a single ProteinIndex, StartPos and DeltaMass per row
+    """
+    tag_df = tag_df[tag_df['ProteinIndex'].notna()]
+    protein_indices = tag_df['ProteinIndex'].astype(str)
+    n_proteins = protein_indices.str.count(';').to_numpy() + 1
+    is_multi = n_proteins > 1
+
+    # every row repeated once per protein, then the ';' separated values are spread over the repeats
+    exploded = tag_df.loc[tag_df.index.repeat(n_proteins)].reset_index(drop=True)
+    if is_multi.any():
+        for column in tag_df.columns:
+            values = tag_df[column]
+            if values.dtype.kind in 'biufcmM':
                 continue
-            if '=' in pair:
-                key, value = pair.split('=')
-                if key == 'peaks':
-                    peaks_values = []
-                    peak_values = value.split(',')
-                    peaks_values.append([tuple(map(int, p.split(':'))) for p in peak_values])
-                    parsed_dict[key] = peaks_values
-                elif ',' in value: # scores
-                    scoremap[key] = [float(x) for x in value[0:len(value)-1].split(',')]
-                else:
-                    parsed_dict[key] = float(value)
-            else:
-                peak_values = pair.split(',')
-                parsed_dict['peaks'].append([tuple(map(int, p.split(':'))) for p in peak_values])
-
-        tolerance = parsed_dict['tol']
-        massoffset= parsed_dict['massoffset']
-        chargemass= parsed_dict['chargemass']
-        peaks = parsed_dict['peaks']
-
-        minCharge=[]
-        maxCharge=[]
-        minIso=[]
-        maxIso=[]
-        allSpecPeaks = []
-        for index, peakinfo in enumerate(peaks):
-            minCharge.append(peakinfo[0][0])
-            maxCharge.append(peakinfo[0][1])
-            minIso.append(peakinfo[1][0])
-            maxIso.append(peakinfo[1][1])
-            mass = spec[index].getMZ()
-
-            masspeaks = []
-            for z in range(minCharge[-1], maxCharge[-1] + 1):
-                minmz = (mass - 3.0)/z + Constants.PROTON_MASS_U
-                maxmz = (mass + 3.0 + maxIso[-1] * Constants.C13C12_MASSDIFF_U)/z + Constants.PROTON_MASS_U
-                minIndex = aspec.findNearest(minmz)
-                for i in range(minIndex, aspec.size()):
-                    if aspec[i].getMZ() > maxmz:
-                        break
-                    if z == round(mass/aspec[i].getMZ()):
-                        masspeaks.append([i, aspec[i].getMZ(), aspec[i].getIntensity()])
-            allSpecPeaks.append(masspeaks)
-
-        for k in scoremap:
-            if k in scoreMaps:
-                scoreMaps[k].append(scoremap[k])
-            else:
-                scoreMaps[k] = [scoremap[k]]
-
-        allPeaks.append(allSpecPeaks)
-        minCharges.append(minCharge)
-        maxCharges.append(maxCharge)
-        minIsotopes.append(minIso)
-        maxIsotopes.append(maxIso)
-        precursorScans.append(parsed_dict['precursorscan'])
-        precursorMasses.append(parsed_dict['precursormass'])
-
-    df['MinCharges'] = minCharges
-    df['MaxCharges'] = maxCharges
-    df['MinIsotopes'] = minIsotopes
-    df['MaxIsotopes'] = maxIsotopes
-    df['PrecursorScan'] = precursorScans
-    df['PrecursorMass'] = precursorMasses
-
-    for k in scoreMaps:
-        df[k] = scoreMaps[k]
-
-    for spec, specPeaks in zip(annotated_exp, allPeaks):
-        mstr = spec.getMetaValue('DeconvMassPeakIndices')
-        # Split the string into peak items
-        peak_items = mstr.split(';')
-        sourcefiles = annotated_exp.getSourceFiles()
-        scan_number = SpectrumLookup().extractScanNumber(spec.getNativeID(), sourcefiles[0].getNativeIDTypeAccession()) if sourcefiles else -1
-        scans.append(scan_number)
-        # Create a list to store the parsed peaks
-        parsed_peaks = []
-
-        # Parse the peak items and store them in the list
-        for item in peak_items:
-            if len(item) == 0:
+            is_split = values.str.contains(';', regex=False).fillna(False).to_numpy(dtype=bool) & is_multi
+            if not is_split.any():
                 continue
-            peak_values = item.split(':')
-            peak_mass = float(peak_values[0])
-            peak_infos = list(map(int, peak_values[1].split(',')))
-            parsed_peaks.append([peak_mass, peak_infos])
-
-        specnpeaks=[]
-        specspeaks=[]
-
-        for index, parsed_peak in enumerate(parsed_peaks): # for each mass
-            massPeaks = specPeaks[index]
-            sigindices = parsed_peak[1] # intersect this with massPeaks[0]s
-            sigindicesset = set(sigindices)
-            npeaks=[]
-            speaks=[]
-            for massPeak in massPeaks:
-                pindex = massPeak[0]
-                if pindex in sigindicesset:
-                    massPeak.append(round(parsed_peak[0]/massPeak[1]))
-                    speaks.append(massPeak)
-                else:
-                    massPeak.append(round(parsed_peak[0]/massPeak[1]))
-                    npeaks.append(massPeak)
-
-            # if len(sigindicesset) != len(speaks):
-                # print("*")
-                # print(len(sigindicesset), len(speaks), len(massPeaks))
-                #for si in sigindices:
-                #    print(si, spec[si].getMZ())
-                #print(speaks)
-                #print(npeaks)
-            specspeaks.append(speaks)
-            specnpeaks.append(npeaks)
-        signalPeaks.append(specspeaks)
-        noisyPeaks.append(specnpeaks)
-        msLevels.append(spec.getMSLevel())
-
-    df['SignalPeaks'] = signalPeaks
-    df['NoisyPeaks'] = noisyPeaks
-    df['CombinedPeaks'] = noisyPeaks
-    df['MSLevel'] = msLevels
-    df['Scan'] = scans
+            parts = values[is_split].astype(str).str.split(';').explode()
+            split_rows = np.repeat(is_split, n_proteins)
+            if len(parts) != np.count_nonzero(split_rows):
+                raise ValueError('Column %s does not have one value per protein for every tag' % column)
+            column_values = exploded[column].to_numpy(dtype=object, copy=True)
+            column_values[split_rows] = parts.to_numpy()
+            exploded[column] = pd.Series(column_values, dtype=values.dtype)
+    for column, dtype in _TAG_NUMERIC_COLUMNS.items():
+        if column in exploded:
+            exploded[column] = pd.to_numeric(exploded[column]).astype(dtype)
+    return exploded
+
+
+def getProteinCoverage(tag_df, protein_indices, lengths):
+    """
+    Number of tags covering every residue of the proteins, from one difference array over all proteins.
+
+    Args:
+        tag_df (pd.DataFrame): tags with one protein per row, 'ProteinIndex', 'StartPos' and 'EndPos' columns
+        protein_indices (array-like): ProteinIndex of every protein
+        lengths (array-like): sequence length of every protein
+
+    Returns:
+        list: per protein, coverage of every residue divided by the maximum coverage of the protein (zeros if uncovered)
+        np.ndarray: maximum coverage of every protein
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    proteins = pd.Index(protein_indices).get_indexer(tag_df['ProteinIndex'])
+    known = proteins >= 0
+    proteins = proteins[known]
+    starts = np.maximum(tag_df['StartPos'].to_numpy()[known], 0)
+    ends = np.minimum(tag_df['EndPos'].to_numpy()[known], lengths[proteins] - 1)
+    inside = starts <= ends
+
+    diff = np.zeros(offsets[-1] + 1, dtype=np.int64)
+    np.add.at(diff, offsets[proteins[inside]] + starts[inside], 1)
+    np.add.at(diff, offsets[proteins[inside]] + ends[inside] + 1, -1)
+    coverage = np.cumsum(diff[:-1]).astype(float)
 
-    return df, annotateddf, tolerance,  massoffset, chargemass
+    max_coverage = np.zeros(len(lengths))
+    non_empty = lengths > 0
+    if non_empty.any():
+        max_coverage[non_empty] = np.maximum.reduceat(coverage, offsets[:-1][non_empty])
+    normalized = coverage / np.repeat(np.where(max_coverage > 0, max_coverage, 1), lengths)
+    return np.split(normalized, offsets[1:-1]), max_coverage
 
 
 def parseFLASHTaggerOutput(tags, proteins):
     # db = get_sequences(FastaFile.read(db), ProteinSequence)
-    return pd.read_csv(tags, sep='\t'), pd.read_csv(proteins, sep='\t')
+    return explodeTagDF(pd.read_csv(tags, sep='\t')), pd.read_csv(proteins, sep='\t')
 
 
 @st.cache_data
@@ -188,17 +441,54 @@ def getSpectraTableDF(deconv_df: pd.DataFrame):
 
 @st.cache_data
 def getMSSignalDF(anno_df: pd.DataFrame):
-    ints = np.concatenate([anno_df.loc[index, "intarray"] for index in anno_df.index])
-    mzs = np.concatenate([anno_df.loc[index, "mzarray"] for index in anno_df.index])
-    rts = np.concatenate(
-        [
-            np.full(len(anno_df.loc[index, "mzarray"]), anno_df.loc[index, "RT"])
-            for index in anno_df.index
-        ]
-    )
-
-    ms_df = pd.DataFrame({'mass': mzs, 'rt': rts, 'intensity': ints})
-    ms_df.dropna(subset=['intensity'], inplace=True) # remove Nan
-    ms_df = ms_df[ms_df['intensity']>0]
-    ms_df.sort_values(by='intensity', inplace=True)
-    return ms_df
+    """
+    All peaks of the spectra as one (mass, rt, intensity) frame, without peaks of zero or NaN intensity.
+
+    Parameters:
+    anno_df (pd.DataFrame): parsed frame with 'mzarray', 'intarray' and 'RT' columns
+
+    Returns:
+    pd.DataFrame: 'mass', 'rt' and 'intensity' columns, sorted by intensity
+    """
+    lengths = anno_df['mzarray'].map(len).to_numpy(dtype=np.int64)
+    mzs = np.concatenate([np.zeros(0)] + anno_df['mzarray'].tolist())
+    ints = np.concatenate([np.zeros(0, dtype=np.float32)] + anno_df['intarray'].tolist())
+    rts = np.repeat(anno_df['RT'].to_numpy(), lengths)
+
+    keep = ints > 0  # also removes NaN
+    mzs, rts, ints = mzs[keep], rts[keep], ints[keep]
+
+    order = np.argsort(ints)
+    return pd.DataFrame({'mass': mzs[order], 'rt': rts[order], 'intensity': ints[order]})
+
+
+def getHeatmapDF(path, ms_level, df: pd.DataFrame, budget=DEFAULT_HEATMAP_BUDGET):
+    """
+    Points of the heatmap of a parsed frame: all of its peaks, or at most budget points of its HeatmapPyramid.
+    The pyramids are built once per mzML file version and MS level, shared by all sessions and
+    charged to the memory budget of the parsed experiments.
+
+    Parameters:
+    path (Path): mzML file the frame was parsed from
+    ms_level (int): MS level of the rows of the frame
+    df (pd.DataFrame): rows of the frame with their 'mzarray', 'intarray' and 'RT' columns
+    budget (int): maximum number of points, 0 for all peaks (no pyramid is built)
+
+    Returns:
+    pd.DataFrame: 'mass', 'rt' and 'intensity' columns, sorted by intensity
+    """
+    if not budget:
+        return getMSSignalDF(df)
+    stamp = getFileStamp(path)
+    key = (str(path), None if stamp is None else tuple(stamp), PARSER_VERSION, ms_level)
+    pyramid = _heatmap_pyramids.get(key)
+    if pyramid is None:
+        pyramid = HeatmapPyramid(getMSSignalDF(df))
+        _heatmap_pyramids.put(key, pyramid, pyramid.nbytes)
+    return pyramid.query(budget)
+
+
+@st.cache_resource(max_entries=32)
+def getScanIndex(key, _deconv_df: pd.DataFrame):
+    """ ScanIndex with the MS levels of a parsed frame, built once per key (file name and parsed version) """
+    return ScanIndex(_deconv_df['Scan'], _deconv_df['MSLevel'])
@@ -0,0 +1,225 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from src.raggedpeaks import RaggedPeaks
+
+
+# parsed experiments are stored in the workspace next to the input file directories
+CACHE_DIR_NAME = 'parsed-cache'
+_META_FILE = 'meta.json'
+# modification time and size of every input file when it was last parsed
+_MANIFEST_FILE = 'manifest.json'
+
+
+def hashFile(path, chunk_size=1 << 20):
+    """ Content hash of a file, read in chunks """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def getCacheKey(paths, version, cache_dir=None):
+    """
+    Key of a parsed artifact: changes whenever any input file content or the parser version changes.
+    The files are only hashed if their modification time or size differ from the ones stored with the artifact.
+
+    Args:
+        paths (list): input files of the parser
+        version (int): version of the parser
+        cache_dir (Path): directory of the stored artifact, if any
+
+    Returns:
+        str: the cache key
+    """
+    if cache_dir is not None:
+        meta = readMeta(cache_dir)
+        if meta is not None and meta['key'].startswith('%s-' % version) \
+                and meta.get('stamps') == [getFileStamp(path) for path in paths]:
+            return meta['key']
+    return '%s-%s' % (version, '-'.join(hashFile(path) for path in paths))
+
+
+def getCacheDir(workspace, name):
+    return Path(workspace, CACHE_DIR_NAME, name)
+
+
+def _manifestKey(path):
+    # input files are stored as <workspace>/<input type>/<file name>
+    return '%s/%s' % (Path(path).parent.name, Path(path).name)
+
+
+def getFileStamp(path):
+    """ Modification time and size of a file, None if it does not exist (anymore) """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def readManifest(workspace):
+    manifest_file = Path(workspace, CACHE_DIR_NAME, _MANIFEST_FILE)
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def recordParsedFiles(workspace, paths):
+    """ Records the current modification time and size of the given input files in the workspace manifest """
+    manifest = readManifest(workspace)
+    for path in paths:
+        stamp = getFileStamp(path)
+        if stamp is None:
+            manifest.pop(_manifestKey(path), None)
+        else:
+            manifest[_manifestKey(path)] = stamp
+    manifest_file = Path(workspace, CACHE_DIR_NAME, _MANIFEST_FILE)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_name(_MANIFEST_FILE + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f)
+    tmp_file.replace(manifest_file)
+
+
+def getChangedFiles(workspace, paths):
+    """
+    Input files that are new, were modified or are missing since they were recorded by recordParsedFiles.
+
+    Args:
+        workspace (Path): the workspace of the files
+        paths (list): input files to check
+
+    Returns:
+        list: the new, modified or missing files among paths
+    """
+    manifest = readManifest(workspace)
+    return [path for path in paths
+            if manifest.get(_manifestKey(path)) is None or manifest[_manifestKey(path)] != getFileStamp(path)]
+
+
+def getChangedExperiments(workspace, input_files):
+    """
+    Names of the experiments with an input file that is new or was modified since it was parsed.
+
+    Args:
+        workspace (Path): the workspace of the files
+        input_files (dict): input file names ('<experiment name>_<suffix>') per input directory of the workspace
+
+    Returns:
+        set: experiment names
+    """
+    paths = [Path(workspace, dirname, f) for dirname, files in input_files.items() for f in files]
+    return {path.name[0: path.name.rfind('_')] for path in getChangedFiles(workspace, paths)}
+
+
+def writeFrame(df, directory):
+    """ Stores the columns (and a non-default index) of a parsed frame as .npy files, returns their descriptions """
+    columns = []
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        if df.index.dtype == object:
+            raise TypeError('The index of the frame can not be stored in the parse cache.')
+        np.save(Path(directory, 'index.npy'), df.index.to_numpy())
+        columns.append({'name': df.index.name, 'kind': 'index', 'file': 'index.npy'})
+    for column in df.columns:
+        values = df[column]
+        file_name = '%s.npy' % len(columns)
+        if values.dtype != object:
+            np.save(Path(directory, file_name), values.to_numpy())
+            columns.append({'name': column, 'kind': 'scalar', 'file': file_name})
+        elif all(isinstance(cell, np.ndarray) for cell in values):
+            # ragged column: one array per row, stored flat with per row offsets
+            lengths = [len(cell) for cell in values]
+            flat = np.concatenate(list(values)) if len(values) else np.zeros(0)
+            np.save(Path(directory, file_name), flat)
+            np.save(Path(directory, 'offsets_' + file_name), np.concatenate([[0], np.cumsum(lengths)]))
+            columns.append({'name': column, 'kind': 'ragged', 'file': file_name})
+        else:
+            raise TypeError('Column %s can not be stored in the parse cache.' % column)
+    return columns
+
+
+def readFrame(columns, directory):
+    """ Loads a frame stored by writeFrame, with all arrays memory mapped """
+    index = None
+    data = {}
+    for column in columns:
+        values = np.load(Path(directory, column['file']), mmap_mode='r')
+        if column['kind'] == 'index':
+            index = pd.Index(values, name=column['name'])
+            continue
+        if column['kind'] == 'ragged':
+            offsets = np.load(Path(directory, 'offsets_' + column['file']))
+            values = pd.Series(np.split(values, offsets[1:-1]) if len(offsets) > 1 else [], dtype=object)
+            values = values.to_numpy()
+        data[column['name']] = values
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def writePeaks(peaks, directory):
+    for name in RaggedPeaks.ARRAY_NAMES:
+        np.save(Path(directory, '%s.npy' % name), getattr(peaks, name))
+
+
+def readPeaks(directory):
+    return RaggedPeaks(*[np.load(Path(directory, '%s.npy' % name), mmap_mode='r') for name in RaggedPeaks.ARRAY_NAMES])
+
+
+def readMeta(cache_dir):
+    """ Meta data of the artifact stored in cache_dir, None if there is none """
+    meta_file = Path(cache_dir, _META_FILE)
+    if not meta_file.exists():
+        return None
+    with open(meta_file, 'r') as f:
+        return json.load(f)
+
+
+def writeParsedOutput(cache_dir, key, spec_df, anno_df, peaks, tolerance, massoffset, chargemass, stamps=None):
+    """
+    Stores the output of parseFLASHDeconvOutput as one .npy file per column, so that it can be memory mapped.
+    The directory is written next to the final one and then swapped in.
+    stamps (getFileStamp of the input files) let getCacheKey skip hashing unchanged input files.
+    """
+    cache_dir = Path(cache_dir)
+    tmp_dir = cache_dir.with_name(cache_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    Path(tmp_dir, 'spec').mkdir(parents=True)
+    Path(tmp_dir, 'anno').mkdir()
+    Path(tmp_dir, 'peaks').mkdir()
+
+    meta = {'key': key, 'stamps': stamps, 'tolerance': tolerance, 'massoffset': massoffset, 'chargemass': chargemass,
+            'spec': writeFrame(spec_df, Path(tmp_dir, 'spec')),
+            'anno': writeFrame(anno_df, Path(tmp_dir, 'anno'))}
+    writePeaks(peaks, Path(tmp_dir, 'peaks'))
+    # meta file is written last: a directory without it is never read
+    with open(Path(tmp_dir, _META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir)
+    tmp_dir.rename(cache_dir)
+
+
+def readParsedOutput(cache_dir, key):
+    """
+    Loads the output of parseFLASHDeconvOutput stored by writeParsedOutput, with all arrays memory mapped.
+
+    Returns:
+        tuple: same as parseFLASHDeconvOutput, or None if nothing is stored for this key
+    """
+    meta = readMeta(cache_dir)
+    if meta is None or meta['key'] != key:
+        return None
+
+    spec_df = readFrame(meta['spec'], Path(cache_dir, 'spec'))
+    anno_df = readFrame(meta['anno'], Path(cache_dir, 'anno'))
+    peaks = readPeaks(Path(cache_dir, 'peaks'))
+    return spec_df, anno_df, peaks, meta['tolerance'], meta['massoffset'], meta['chargemass']
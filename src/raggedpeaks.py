@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class RaggedPeaks:
+    """
+    Peaks assigned to every deconvolved mass of every scan, kept as flat arrays (CSR layout)
+    instead of nested Python lists.
+
+    The masses of scan i are [scan_offsets[i], scan_offsets[i+1]) and the peaks of mass j are
+    [mass_offsets[j], mass_offsets[j+1]) of the per-peak arrays. is_signal tells whether
+    FLASHDeconv used the peak for the mass (signal peak) or not (noisy peak).
+
+    Attributes:
+        peak_index (np.ndarray): int32, index of the peak in the annotated spectrum
+        mz (np.ndarray): float64, m/z of the peak
+        intensity (np.ndarray): float64, intensity of the peak
+        charge (np.ndarray): int32, charge of the peak for its mass
+        is_signal (np.ndarray): bool, signal (True) or noisy (False) peak
+        mass_offsets (np.ndarray): int64, per mass offsets into the per-peak arrays
+        scan_offsets (np.ndarray): int64, per scan offsets into mass_offsets
+    """
+    # per-peak and offset arrays, in the order of the constructor arguments
+    ARRAY_NAMES = ('peak_index', 'mz', 'intensity', 'charge', 'is_signal', 'mass_offsets', 'scan_offsets')
+
+    def __init__(self, peak_index, mz, intensity, charge, is_signal, mass_offsets, scan_offsets):
+        self.peak_index = np.asarray(peak_index, dtype=np.int32)
+        self.mz = np.asarray(mz, dtype=np.float64)
+        self.intensity = np.asarray(intensity, dtype=np.float64)
+        self.charge = np.asarray(charge, dtype=np.int32)
+        self.is_signal = np.asarray(is_signal, dtype=bool)
+        self.mass_offsets = np.asarray(mass_offsets, dtype=np.int64)
+        self.scan_offsets = np.asarray(scan_offsets, dtype=np.int64)
+
+    @classmethod
+    def fromScans(cls, scans):
+        """
+        Builds the container from per scan arrays.
+
+        Args:
+            scans (list): per scan tuple (number of masses, mass index, peak index, mz, intensity, charge,
+                          is_signal), per-peak arrays ordered by mass index
+
+        Returns:
+            RaggedPeaks: peaks of all scans
+        """
+        mass_counts = [np.bincount(scan[1], minlength=scan[0]) for scan in scans]
+        scan_offsets = np.concatenate([[0], np.cumsum([scan[0] for scan in scans])])
+        mass_offsets = np.concatenate([[0], np.cumsum(np.concatenate(mass_counts))]) if scans else np.zeros(1)
+
+        def _concat(column, dtype):
+            return np.concatenate([scan[column] for scan in scans]) if scans else np.zeros(0, dtype=dtype)
+
+        return cls(_concat(2, np.int32), _concat(3, np.float64), _concat(4, np.float64),
+                   _concat(5, np.int32), _concat(6, bool), mass_offsets, scan_offsets)
+
+    def __len__(self):
+        return len(self.scan_offsets) - 1
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAY_NAMES)
+
+    def scan(self, scan_index):
+        """ Peaks of a single scan, as a container of one scan sharing memory with this one """
+        mass_begin, mass_end = self.scan_offsets[scan_index], self.scan_offsets[scan_index + 1]
+        peak_begin, peak_end = self.mass_offsets[mass_begin], self.mass_offsets[mass_end]
+        return RaggedPeaks(self.peak_index[peak_begin:peak_end], self.mz[peak_begin:peak_end],
+                           self.intensity[peak_begin:peak_end], self.charge[peak_begin:peak_end],
+                           self.is_signal[peak_begin:peak_end],
+                           self.mass_offsets[mass_begin:mass_end + 1] - peak_begin, [0, mass_end - mass_begin])
+
+    def select(self, scan_indices):
+        """ Peaks of the given scans (in the given order) """
+        return RaggedPeaks.fromScans([self.scan(scan_index)._asScan() for scan_index in scan_indices])
+
+    def _asScan(self):
+        n_masses = len(self.mass_offsets) - 1
+        mass_ids = np.repeat(np.arange(n_masses), np.diff(self.mass_offsets))
+        return n_masses, mass_ids, self.peak_index, self.mz, self.intensity, self.charge, self.is_signal
+
+    def toNestedList(self, kind=None):
+        """
+        Converts the peaks into the nested list form used by the viewer components.
+
+        Args:
+            kind (str): 'signal' or 'noisy' to only keep those peaks, None for all peaks
+
+        Returns:
+            list: per scan, per mass list of [peak index, mz, intensity, charge]
+        """
+        keep = np.ones(len(self.mz), dtype=bool)
+        if kind == 'signal':
+            keep = self.is_signal
+        elif kind == 'noisy':
+            keep = ~self.is_signal
+
+        n_masses = len(self.mass_offsets) - 1
+        mass_ids = np.repeat(np.arange(n_masses), np.diff(self.mass_offsets))[keep]
+        mass_offsets = np.searchsorted(mass_ids, np.arange(n_masses + 1)).tolist()
+        peaks = [list(peak) for peak in zip(self.peak_index[keep].tolist(), self.mz[keep].tolist(),
+                                            self.intensity[keep].tolist(), self.charge[keep].tolist())]
+        mass_peaks = [peaks[begin:end] for begin, end in zip(mass_offsets[:-1], mass_offsets[1:])]
+        scan_offsets = self.scan_offsets.tolist()
+        return [mass_peaks[begin:end] for begin, end in zip(scan_offsets[:-1], scan_offsets[1:])]
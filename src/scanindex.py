@@ -0,0 +1,74 @@
+import re
+import numpy as np
+from pyopenms import SpectrumLookup
+
+
+# Thermo nativeID format, e.g. 'controllerType=0 controllerNumber=1 scan=42'
+_THERMO_NATIVE_ID_TYPE = 'MS:1000768'
+_THERMO_SCAN = re.compile(r'scan=(\d+)')
+
+
+def extractScanNumbers(native_ids, native_id_type):
+    """
+    Scan numbers of all spectra of a file, same as SpectrumLookup.extractScanNumber on each native ID.
+
+    Args:
+        native_ids (list): native ID of every spectrum
+        native_id_type (str): accession of the nativeID format of the file, None if the file has no source file
+
+    Returns:
+        np.ndarray: int64, scan number of every spectrum, -1 if it could not be extracted
+    """
+    if native_id_type is None:
+        return np.full(len(native_ids), -1, dtype=np.int64)
+    if native_id_type == _THERMO_NATIVE_ID_TYPE:
+        matches = [_THERMO_SCAN.search(native_id) for native_id in native_ids]
+        return np.array([int(m.group(1)) if m else -1 for m in matches], dtype=np.int64)
+    # any other format: one lookup object for the whole file
+    lookup = SpectrumLookup()
+    return np.array([lookup.extractScanNumber(native_id, native_id_type) for native_id in native_ids],
+                    dtype=np.int64)
+
+
+class ScanIndex:
+    """
+    Mapping between scan numbers and spectrum indices (row of the parsed frames) of a file.
+
+    Attributes:
+        scans (np.ndarray): int64, scan number of every spectrum
+        ms_levels (np.ndarray): int64, MS level of every spectrum, None if not given
+    """
+
+    def __init__(self, scans, ms_levels=None):
+        self.scans = np.asarray(scans, dtype=np.int64)
+        self.ms_levels = None if ms_levels is None else np.asarray(ms_levels, dtype=np.int64)
+        # rows of each MS level, in spectrum order
+        self._level_rows = {}
+        if self.ms_levels is not None and len(self.ms_levels):
+            order = np.argsort(self.ms_levels, kind='stable')
+            levels, starts = np.unique(self.ms_levels[order], return_index=True)
+            self._level_rows = dict(zip(levels.tolist(), np.split(order, starts[1:])))
+        # valid scan numbers sorted, with their spectrum indices: the first spectrum wins for repeated scan numbers
+        valid = np.flatnonzero(self.scans >= 0)
+        order = valid[np.argsort(self.scans[valid], kind='stable')]
+        self._sorted_scans = self.scans[order]
+        self._sorted_indices = order
+
+    def __len__(self):
+        return len(self.scans)
+
+    def rowsOfLevel(self, ms_level):
+        """ Spectrum indices of the given MS level, in spectrum order """
+        return self._level_rows.get(ms_level, np.zeros(0, dtype=np.int64))
+
+    def scanOf(self, spectrum_indices):
+        return self.scans[spectrum_indices]
+
+    def indexOf(self, scans):
+        """ Spectrum indices of the given scan numbers, -1 for scans not in the file """
+        scans = np.asarray(scans, dtype=np.int64)
+        if len(self._sorted_scans) == 0:
+            return np.full(scans.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._sorted_scans, scans, side='left'), len(self._sorted_scans) - 1)
+        known = (self._sorted_scans[positions] == scans) & (scans >= 0)
+        return np.where(known, self._sorted_indices[positions], -1)
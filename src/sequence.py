@@ -1,6 +1,15 @@
+import os
+import re
+import uuid
+import hashlib
+import numpy as np
 import streamlit as st
+from pathlib import Path
+from functools import lru_cache
 from pyopenms import Residue, AASequence, ModificationsDB
 
+from src.parsecache import CACHE_DIR_NAME
+
 
 fixed_mod_cysteine = {'No modification': 0,
                       'Carbamidomethyl (+57)': 57.021464,
@@ -14,45 +23,102 @@ fixed_mod_methionine = {'No modification': 0,
 H20 = 18.010564683
 NH3 = 17.0265491015
 
+# bump whenever the masses computed here change: invalidates the fragment masses stored in every workspace
+FRAGMENT_ENGINE_VERSION = 2
+# fragment masses are stored in <workspace>/parsed-cache/fragments, the least recently used entries are removed
+# when the store grows larger than _FRAGMENT_STORE_MAX_BYTES
+_FRAGMENT_STORE_DIR_NAME = 'fragments'
+_FRAGMENT_STORE_MAX_BYTES = 256 * 1024 * 1024
+
+
+# ion type -> (residue type, True for prefix ions)
+_ION_TYPES = {'a': (Residue.ResidueType.AIon, True),
+              'b': (Residue.ResidueType.BIon, True),
+              'c': (Residue.ResidueType.CIon, True),
+              'x': (Residue.ResidueType.XIon, False),
+              'y': (Residue.ResidueType.YIon, False),
+              'z': (Residue.ResidueType.ZIon, False),
+              }
+# one letter codes of the residues with a mass (AASequence also reads the ambiguous B, Z and X, without a mass)
+_RESIDUE_LETTERS = frozenset('ACDEFGHIJKLMNOPQRSTUVWY')
+# one residue of AASequence.toString(), with its modification, e.g. 'C(Carbamidomethyl)' or 'K[+42.0106]'
+_RESIDUE_TOKEN = re.compile(r'[A-Z](?:\((?:[^()]|\([^()]*\))*\)|\[[^\]]*\])?')
+
+
+@lru_cache(maxsize=None)
+def _residueMass(token):
+    return AASequence.fromString(token).getResidue(0).getMonoWeight(Residue.ResidueType.Internal)
+
+
+def getResidueMasses(protein):
+    """
+    Internal (in-chain) mono-isotopic mass of every residue of the sequence, modifications included.
+
+    Args:
+        protein (AASequence): sequence
+
+    Returns:
+        np.ndarray: float64, one mass per residue
+    """
+    tokens = _RESIDUE_TOKEN.findall(protein.toString())
+    if protein.hasNTerminalModification() or protein.hasCTerminalModification() or len(tokens) != protein.size():
+        return np.array([protein.getResidue(i).getMonoWeight(Residue.ResidueType.Internal)
+                         for i in range(protein.size())], dtype=np.float64)
+    masses = {token: _residueMass(token) for token in set(tokens)}
+    return np.array([masses[token] for token in tokens], dtype=np.float64)
+
 
 # NOTE: cannot cache this function: cannot hash "OpenMS.AASequence"
+def getFragmentMassLadders(protein, ion_types='abcxyz'):
+    """
+    Masses of all fragment ions of a sequence from cumulative sums of its residue masses, the same as
+    AASequence.getPrefix(i).getMonoWeight(ion_type, 0) and getSuffix(i) for every i (up to floating point round-off).
+
+    Args:
+        protein (AASequence): sequence
+        ion_types (str): letters of the ion types, out of 'abcxyz'
+
+    Returns:
+        dict: ion type -> np.ndarray, mass of the fragment of length i+1 at index i
+    """
+    if protein.size() == 0:
+        return {ion_type: np.zeros(0) for ion_type in ion_types}
+    residue_masses = getResidueMasses(protein)
+    prefix_masses = np.cumsum(residue_masses)
+    suffix_masses = np.cumsum(residue_masses[::-1])
+
+    ladders = {}
+    for ion_type in ion_types:
+        residue_type, is_prefix = _ION_TYPES[ion_type]
+        # terminal groups (and terminal modifications) of the ion type, from the fragment of one residue
+        if is_prefix:
+            offset = protein.getPrefix(1).getMonoWeight(residue_type, 0) - residue_masses[0]
+            ladders[ion_type] = prefix_masses + offset
+        else:
+            offset = protein.getSuffix(1).getMonoWeight(residue_type, 0) - residue_masses[-1]
+            ladders[ion_type] = suffix_masses + offset
+    return ladders
+
+
 def getFragmentMassesWithSeq(protein, res_type):
-    protein_length = protein.size()
-    prefix_mass_list = [.0] * protein_length
-    suffix_mass_list = [.0] * protein_length
-
-    # get type for fragments
-    prefix_ion_type, suffix_ion_type = None, None
-    if res_type == 'ax':
-        prefix_ion_type = Residue.ResidueType.AIon
-        suffix_ion_type = Residue.ResidueType.XIon
-    elif res_type == 'by':
-        prefix_ion_type = Residue.ResidueType.BIon
-        suffix_ion_type = Residue.ResidueType.YIon
-    elif res_type == 'cz':
-        prefix_ion_type = Residue.ResidueType.CIon
-        suffix_ion_type = Residue.ResidueType.ZIon
-
-    # process prefix
-    for aa_index in range(protein_length):
-        prefix_mass = protein.getPrefix(aa_index+1).getMonoWeight(prefix_ion_type, 0)  # + added_ptm_masses
-        prefix_mass_list[aa_index] = prefix_mass
-
-    # process suffix
-    for aa_index in reversed(range(protein_length)):
-        suffix_mass = protein.getSuffix(aa_index+1).getMonoWeight(suffix_ion_type, 0)  # + added_ptm_masses
-        suffix_mass_list[aa_index] = suffix_mass
-
-    return prefix_mass_list, suffix_mass_list
+    ladders = getFragmentMassLadders(protein, res_type)
+    return ladders[res_type[0]].tolist(), ladders[res_type[1]].tolist()
+
+
+def getFixedModifications():
+    """ Names of the fixed modifications on cysteine and methionine selected in the sequence input page """
+    return (st.session_state.get('fixed_mod_cysteine') or None), (st.session_state.get('fixed_mod_methionine') or None)
 
 
 # NOTE: cannot cache this function: cannot hash "OpenMS.AASequence"
-def setFixedModification(protein):
+def setFixedModification(protein, fixed_mods=None):
+    """ fixed_mods: names of the cysteine and methionine modifications, the selected ones (getFixedModifications) if None """
+    cysteine_mod, methionine_mod = getFixedModifications() if fixed_mods is None else fixed_mods
     fixed_mod_site = []
 
     # fixed modification on cysteine
-    if 'fixed_mod_cysteine' in st.session_state and st.session_state['fixed_mod_cysteine']:
-        mod_mass = fixed_mod_cysteine[st.session_state['fixed_mod_cysteine']]
+    if cysteine_mod:
+        mod_mass = fixed_mod_cysteine[cysteine_mod]
         for index, aa in enumerate(protein.toString()):
             if aa != 'C':
                 continue
@@ -62,8 +128,8 @@ def setFixedModification(protein):
         fixed_mod_site.append('C')
 
     # fixed modification on methionine
-    if 'fixed_mod_methionine' in st.session_state and st.session_state['fixed_mod_methionine']:
-        mod_mass = fixed_mod_methionine[st.session_state['fixed_mod_methionine']]
+    if methionine_mod:
+        mod_mass = fixed_mod_methionine[methionine_mod]
         for index, aa in enumerate(protein.toUnmodifiedString()):
             if aa != 'M':
                 continue
@@ -75,31 +141,205 @@ def setFixedModification(protein):
     return protein, fixed_mod_site
 
 
-#@st.cache_data
-def getFragmentDataFromSeq(sequence, coverage=None, maxCoverage=None):
-    protein = AASequence.fromString(sequence)
-    protein, fixed_mods = setFixedModification(protein)  # handling fixed modifications
+def _fragmentStorePath(workspace, key):
+    if workspace is None:
+        return None
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    return Path(workspace, CACHE_DIR_NAME, _FRAGMENT_STORE_DIR_NAME, digest + '.npz')
+
+
+def _readFragmentStore(path):
+    if path is None or not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as stored:
+            arrays = {name: stored[name] for name in stored.files}
+        os.utime(path)  # the modification time orders the entries by their last use, see _pruneFragmentStore
+        return arrays
+    except (OSError, ValueError):  # e.g. written by a process that was killed or removed by another one
+        return None
+
+
+def _writeFragmentStore(path, arrays):
+    if path is None:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name('%s.%s.tmp.npz' % (path.stem, uuid.uuid4().hex))  # sessions may write the same entry
+    np.savez(tmp_file, **arrays)
+    tmp_file.replace(path)
+    _pruneFragmentStore(path.parent)
+
+
+def _pruneFragmentStore(store_dir, max_bytes=_FRAGMENT_STORE_MAX_BYTES):
+    """ Removes the least recently used entries until the store is at most max_bytes large """
+    entries = []
+    for entry in os.scandir(store_dir):
+        if '.tmp.' in entry.name:  # being written
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:  # removed by another session
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            continue
+        total_size -= size
+
+
+@st.cache_data(max_entries=256)
+def getFragmentArrays(sequence, fixed_mods, ion_types, workspace=None, version=FRAGMENT_ENGINE_VERSION):
+    """
+    Proteoform mass and fragment masses of a sequence, cached in memory (least recently used entries are dropped)
+    and in the workspace, so that they are computed once per sequence and modifications.
+
+    Args:
+        sequence (str): unmodified amino acid sequence
+        fixed_mods (tuple): names of the fixed modifications on cysteine and methionine, None for no modification
+        ion_types (str): letters of the ion types, out of 'abcxyz'
+        workspace (str): workspace whose disk store is used, None for the memory cache only
+        version (int): FRAGMENT_ENGINE_VERSION, part of the key of the cached masses
+
+    Returns:
+        dict: 'theoretical_mass', 'fixed_modifications' and 'fragment_masses_<ion type>' arrays
+    """
+    path = _fragmentStorePath(workspace, ('fragments', sequence, tuple(fixed_mods), ion_types, version))
+    arrays = _readFragmentStore(path)
+    if arrays is not None:
+        return arrays
+
+    protein, fixed_mod_sites = setFixedModification(AASequence.fromString(sequence), fixed_mods)
+    arrays = {'theoretical_mass': np.float64(protein.getMonoWeight()),  # proteoform mass
+              'fixed_modifications': np.array(fixed_mod_sites, dtype=str)}
+    for ion_type, masses in getFragmentMassLadders(protein, ion_types).items():
+        arrays['fragment_masses_%s' % ion_type] = masses
+    _writeFragmentStore(path, arrays)
+    return arrays
+
+
+def _currentWorkspace():
+    workspace = st.session_state.get('workspace')
+    return None if workspace is None else str(workspace)
 
-    # calculating proteoform mass from sequence
-    protein_mass = protein.getMonoWeight()
+
+def getFragmentDataFromSeq(sequence, coverage=None, maxCoverage=None):
+    arrays = getFragmentArrays(sequence, getFixedModifications(), 'axbycz', _currentWorkspace())
 
     out_object = {'sequence': list(sequence),
-                  'theoretical_mass': protein_mass, 
-                  'fixed_modifications': fixed_mods}
+                  'theoretical_mass': float(arrays['theoretical_mass']),
+                  'fixed_modifications': arrays['fixed_modifications'].tolist()}
     if coverage is not None:
         out_object['coverage'] = list(coverage)
     if maxCoverage is not None:
         out_object['maxCoverage'] = maxCoverage
 
-    # per ion type, calculate the possible fragment masses and save them in dictionary
-    for ion_type in ['ax', 'by', 'cz']:
-        # calculate fragment ion masses
-        prefix_ions, suffix_ions = getFragmentMassesWithSeq(protein, ion_type)
-        out_object['fragment_masses_%s' % ion_type[0]] = prefix_ions
-        out_object['fragment_masses_%s' % ion_type[1]] = suffix_ions
+    # per ion type, the possible fragment masses
+    for ion_type in 'axbycz':
+        out_object['fragment_masses_%s' % ion_type] = arrays['fragment_masses_%s' % ion_type].tolist()
 
     return out_object
 
+
+@lru_cache(maxsize=None)
+def _modifiedResidueMass(residue, fixed_mods):
+    protein, _ = setFixedModification(AASequence.fromString(residue), fixed_mods)
+    return getResidueMasses(protein)[0]
+
+
+@lru_cache(maxsize=None)
+def _terminalMass(ion_type):
+    # mass of an ion type without its residues, 'full' for the whole (unfragmented) sequence
+    glycine = AASequence.fromString('G')
+    residue_mass = glycine.getResidue(0).getMonoWeight(Residue.ResidueType.Internal)
+    if ion_type == 'full':
+        return glycine.getMonoWeight() - residue_mass
+    residue_type, _ = _ION_TYPES[ion_type]
+    return glycine.getMonoWeight(residue_type, 0) - residue_mass
+
+
+def getFragmentLaddersBatch(sequences, fixed_mods=None, ion_types='axbycz'):
+    """
+    Fragment masses of many sequences in one pass over their concatenated residue masses. Gives the same masses as
+    getFragmentMassLadders on each sequence, up to floating point round-off.
+
+    Args:
+        sequences (list): unmodified amino acid sequences (str)
+        fixed_mods (tuple): names of the fixed modifications on cysteine and methionine,
+                            the selected ones (getFixedModifications) if None
+        ion_types (str): letters of the ion types, out of 'abcxyz'
+
+    Returns:
+        dict: 'offsets' (the masses of sequence i are at [offsets[i], offsets[i+1]) of every ladder),
+              'theoretical_masses' (proteoform mass of every sequence), 'fixed_modifications' (modified residues)
+              and per ion type the concatenated ladders (mass of the fragment of length j+1 at offsets[i] + j)
+    """
+    fixed_mods = getFixedModifications() if fixed_mods is None else tuple(fixed_mods)
+    for index, sequence in enumerate(sequences):
+        unknown = set(sequence) - _RESIDUE_LETTERS
+        if unknown:
+            raise ValueError('Sequence %d contains unknown residues %s.'
+                             % (index, ', '.join(map(repr, sorted(unknown)))))
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    residues = np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8)
+    residue_table = np.zeros(256)
+    for residue in np.unique(residues):
+        residue_table[residue] = _modifiedResidueMass(chr(residue), fixed_mods)
+    residue_masses = residue_table[residues]
+    # running sum of the residue masses that starts again at every sequence: the total of the previous sequence
+    # is taken off at the start of each sequence, which keeps the round-off as small as within a single sequence
+    non_empty = np.flatnonzero(lengths)
+    if len(non_empty) > 1:
+        totals = np.add.reduceat(residue_masses, offsets[non_empty])
+        residue_masses[offsets[non_empty[1:]]] -= totals[:-1]
+    cumulative_masses = np.cumsum(residue_masses)
+
+    # position j of sequence i: prefix of length j + 1 and suffix of length j + 1 (the total minus the prefix
+    # of length offsets[i+1] - offsets[i] - j - 1)
+    starts = np.repeat(offsets[:-1], lengths)
+    ends = np.repeat(offsets[1:], lengths)
+    prefix_masses = cumulative_masses
+    complements = starts + ends - 2 - np.arange(offsets[-1])
+    suffix_masses = cumulative_masses[ends - 1] - np.where(complements >= starts,
+                                                            cumulative_masses[np.maximum(complements, 0)], 0.)
+    sequence_masses = np.zeros(len(lengths))
+    sequence_masses[non_empty] = cumulative_masses[offsets[non_empty + 1] - 1]
+
+    fixed_mod_sites = [site for site, mod in zip('CM', fixed_mods) if mod]  # as setFixedModification
+    ladders = {'offsets': offsets,
+               'theoretical_masses': np.where(lengths > 0, sequence_masses + _terminalMass('full'), 0.),
+               'fixed_modifications': fixed_mod_sites}
+    for ion_type in ion_types:
+        _, is_prefix = _ION_TYPES[ion_type]
+        ladders[ion_type] = (prefix_masses if is_prefix else suffix_masses) + _terminalMass(ion_type)
+    return ladders
+
+
+def getFragmentDataOfSequences(sequences, coverages=None, max_coverages=None, fixed_mods=None):
+    """ getFragmentDataFromSeq of every sequence (and its coverage), from one getFragmentLaddersBatch """
+    ladders = getFragmentLaddersBatch(sequences, fixed_mods)
+    offsets = ladders['offsets']
+    out_objects = []
+    for index, sequence in enumerate(sequences):
+        out_object = {'sequence': list(sequence),
+                      'theoretical_mass': float(ladders['theoretical_masses'][index]),
+                      'fixed_modifications': list(ladders['fixed_modifications'])}
+        if coverages is not None:
+            out_object['coverage'] = list(coverages[index])
+        if max_coverages is not None:
+            out_object['maxCoverage'] = max_coverages[index]
+        for ion_type in 'axbycz':
+            out_object['fragment_masses_%s' % ion_type] = ladders[ion_type][offsets[index]:offsets[index + 1]].tolist()
+        out_objects.append(out_object)
+    return out_objects
+
+
 # Define amino acid masses with high resolution
 aa_masses = {
     'A': 71.037114,
@@ -139,36 +379,89 @@ def calculate_exact_mass(sequence, shift):
     return mass
 
 
-def getInternalFragmentMassesWithSeq(sequence, res_type):
+# most candidate fragments (start, end pairs) evaluated at once by getInternalFragmentMassesWithSeq
+_INTERNAL_FRAGMENT_CHUNK_SIZE = 1 << 20
+
+
+def _internalFragmentChunks(sequence, shift, min_length, max_length, mass_range, chunk_size):
+    # the fragments of a block of start positions at a time, so that the (start x end) temporaries stay below
+    # chunk_size elements for long sequences
+    length = len(sequence)
+    index_type = np.int16 if length <= np.iinfo(np.int16).max else np.int32
+    prefix_masses = np.concatenate([[0.], np.cumsum([aa_masses[aa] for aa in sequence])])
+
+    ends = np.arange(1, length + 1)
+    rows_per_chunk = max(1, chunk_size // max(length, 1))
+    for first_start in range(0, max(length - min_length + 1, 0), rows_per_chunk):
+        starts = np.arange(first_start, min(first_start + rows_per_chunk, length))
+        lengths = ends[np.newaxis, :] - starts[:, np.newaxis]
+        keep = (lengths >= min_length) & (lengths <= max_length)
+        masses = prefix_masses[np.newaxis, 1:] - prefix_masses[starts, np.newaxis] + (H20 + shift)
+        if mass_range is not None:
+            keep &= (masses >= mass_range[0]) & (masses <= mass_range[1])
+        rows, columns = np.nonzero(keep)
+        yield masses[rows, columns], starts[rows].astype(index_type), ends[columns].astype(index_type)
+
+
+def getInternalFragmentMassesWithSeq(sequence, res_type, min_length=5, max_length=None, mass_range=None,
+                                     chunk_size=_INTERNAL_FRAGMENT_CHUNK_SIZE):
+    """
+    Internal fragments sequence[start:end] of the sequence, from one prefix sum of the residue masses,
+    ordered by start, then by end. All fragments are returned at once; chunk_size only bounds the memory of
+    the temporary arrays.
+
+    Args:
+        sequence (str): unmodified amino acid sequence
+        res_type (str): ion types of the two ends, 'by', 'cz', 'bz' or 'cy'
+        min_length (int): minimum number of residues of a fragment
+        max_length (int): maximum number of residues of a fragment, None for no limit
+        mass_range (tuple): (min, max) mass of the fragments, None for all
+        chunk_size (int): maximum number of candidate fragments evaluated at once
+
+    Returns:
+        tuple: masses (float64), start indices and end indices (exclusive) of the fragments
+               (int16, int32 for sequences longer than 32767 residues)
+    """
     shift = -H20 if res_type == 'by' or res_type == 'cz' else (-H20-NH3 if res_type == 'bz' else -H20+NH3)
-    masses = []
-    start_indices = []
-    end_indices = []
-    # protein('sequence', protein.toString())
-    for i, s in enumerate(sequence):
-        if i == len(sequence)-1:
-            break
-        for j, t in enumerate(sequence):
-            if j < i+5-1:
-                continue
-            subs = sequence[i:j+1]
-            masses.append(calculate_exact_mass(subs, shift))
-            start_indices.append(i)
-            end_indices.append(j+1)
-    return masses, start_indices, end_indices
+    max_length = len(sequence) if max_length is None else min(max_length, len(sequence))
+    chunks = list(_internalFragmentChunks(sequence, shift, min_length, max_length, mass_range, chunk_size))
+    if not chunks:
+        return np.zeros(0), np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)
+    return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+
+@st.cache_data(max_entries=64)
+def getInternalFragmentArrays(sequence, ion_types, workspace=None, version=FRAGMENT_ENGINE_VERSION):
+    """
+    Internal fragments of a sequence (see getInternalFragmentMassesWithSeq) per pair of ion types, cached like
+    getFragmentArrays.
+
+    Returns:
+        dict: 'fragment_masses_<ion types>', 'start_indices_<ion types>' and 'end_indices_<ion types>' arrays
+    """
+    path = _fragmentStorePath(workspace, ('internal_fragments', sequence, tuple(ion_types), version))
+    arrays = _readFragmentStore(path)
+    if arrays is not None:
+        return arrays
+
+    arrays = {}
+    for ion_type in ion_types:
+        ions, start_indices, end_indices = getInternalFragmentMassesWithSeq(sequence, ion_type)
+        arrays['fragment_masses_%s' % ion_type] = ions
+        arrays['start_indices_%s' % ion_type] = start_indices
+        arrays['end_indices_%s' % ion_type] = end_indices
+    _writeFragmentStore(path, arrays)
+    return arrays
 
 
-#@st.cache_data
 def getInternalFragmentDataFromSeq(sequence):
     # TODO: fixed modification
     # protein = AASequence.fromString(sequence)
     # protein, fixed_mods = setFixedModification(protein)  # handling fixed modifications
 
+    arrays = getInternalFragmentArrays(sequence, ('by', 'bz', 'cy'), _currentWorkspace())  # by cz are the same.
     out_object = {}  # sequence information is from "sequence_data"
-    for ion_type in ['by', 'bz', 'cy']:  # by cz are the same.
-        ions, start_indices, end_indices = getInternalFragmentMassesWithSeq(sequence, ion_type)
-        out_object['fragment_masses_%s' % ion_type] = ions
-        out_object['start_indices_%s' % ion_type] = start_indices
-        out_object['end_indices_%s' % ion_type] = end_indices
+    for name, values in arrays.items():
+        out_object[name] = values.tolist()
 
     return out_object
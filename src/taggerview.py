@@ -0,0 +1,63 @@
+import itertools
+
+from src.scanindex import ScanIndex
+from src.masstable import getProteinCoverage
+from src.sequence import getFragmentDataOfSequences, getFixedModifications
+
+
+_versions = itertools.count(1)
+
+
+class TaggerViewModel:
+    """
+    Tables of one FLASHTagger experiment as they are sent to the viewer, built once when the experiment is parsed.
+    The parsed frames are not modified and the viewer must not modify the tables either.
+
+    Attributes:
+        version (int): process-unique number of the view model, changes when the experiment is parsed again
+        tag_table (pd.DataFrame): tags with one protein per row, 'Scan' is the row of the scan in the MS2 scan table
+        protein_table (pd.DataFrame): proteins with their 'length'
+        coverages (list): per protein, normalized number of tags covering each residue
+        max_coverages (np.ndarray): maximum coverage of every protein
+        fixed_modifications (tuple): fixed modifications the fragment masses of sequence_data were computed with
+        sequence_data (dict): ProteinIndex -> sequence, coverage and fragment masses of the protein
+    """
+
+    def __init__(self, spec_df, tag_df, protein_df):
+        self.version = next(_versions)
+        # scan numbers of the tags to rows of the MS2 scan table
+        ms2_scans = spec_df['Scan'].to_numpy()[spec_df['MSLevel'].to_numpy() == 2]
+        tag_table = tag_df.copy()
+        tag_table['Scan'] = ScanIndex(ms2_scans).indexOf(tag_table['Scan'])
+        tag_table['EndPos'] = tag_table['StartPos'] + tag_table['Length'] - 1
+        self.tag_table = tag_table.rename(columns={'DeNovoScore': 'Score', 'Masses': 'mzs'})
+
+        protein_table = protein_df.copy()
+        protein_table['length'] = protein_table['ProteinSequence'].apply(len)
+        self.protein_table = protein_table.rename(
+            columns={
+                'ProteinIndex': 'index',
+                'ProteinAccession': 'accession',
+                'ProteinDescription': 'description',
+                'ProteinSequence': 'sequence'
+            }
+        )
+
+        self.coverages, self.max_coverages = getProteinCoverage(
+            self.tag_table, self.protein_table['index'], self.protein_table['length'])
+        self.fixed_modifications = getFixedModifications()
+        self.sequence_data = self._computeSequenceData()
+
+    def _computeSequenceData(self):
+        sequences = [str(sequence) for sequence in self.protein_table['sequence']]
+        return dict(zip(self.protein_table['index'],
+                        getFragmentDataOfSequences(sequences, self.coverages, self.max_coverages,
+                                                   self.fixed_modifications)))
+
+    def getSequenceData(self):
+        """ sequence_data, recomputed (and kept) if the fixed modifications were changed since it was computed """
+        fixed_modifications = getFixedModifications()
+        if fixed_modifications != self.fixed_modifications:
+            self.fixed_modifications = fixed_modifications
+            self.sequence_data = self._computeSequenceData()
+        return self.sequence_data
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+EXAMPLE_DATA = ROOT / 'example-data'
+
+
+@pytest.fixture(scope='session')
+def tagger_experiment():
+    """ (annotated, deconvolved) mzML files of the smallest FLASHTagger example """
+    base = EXAMPLE_DATA / 'flashtagger' / 'example_spectrum_1'
+    return str(base) + '_annotated.mzML', str(base) + '_deconv.mzML'
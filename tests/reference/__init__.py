@@ -0,0 +1 @@
+# implementations of the baseline the optimized ones are checked against, do not modify
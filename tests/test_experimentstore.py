@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import experimentstore
+from src.experimentstore import ExperimentStore
+from src.raggedpeaks import RaggedPeaks
+
+
+@pytest.fixture
+def budget():
+    yield experimentstore.setMemoryBudget
+    experimentstore.setMemoryBudget(experimentstore.DEFAULT_MEMORY_BUDGET_MB)
+
+
+def _frame(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'RT': rng.uniform(0, 100, n_rows),
+                         'MSLevel': rng.integers(1, 3, n_rows),
+                         'mzarray': pd.Series([rng.uniform(100, 2000, rng.integers(0, 50)) for _ in range(n_rows)],
+                                              dtype=object)})
+
+
+def _assertSameFrame(frame, expected):
+    assert frame.index.equals(expected.index)
+    assert list(frame.columns) == list(expected.columns)
+    for column in frame.columns:
+        for value, expected_value in zip(frame[column], expected[column]):
+            np.testing.assert_array_equal(value, expected_value)
+
+
+def test_spill_and_reload(tmp_path, budget):
+    budget(0)  # everything but the entry in use is spilled
+    store = ExperimentStore(tmp_path)
+    frames = {'a': _frame(20, 1), 'b': _frame(30, 2).set_index(np.arange(30)[::-1] * 7)}
+    peaks = RaggedPeaks([1, 2, 3], [100.0, 200.0, 300.0], [1.0, 2.0, 3.0], [1, 2, 1], [True, False, True],
+                        [0, 2, 3], [0, 1, 2])
+    for key, frame in frames.items():
+        store[key] = frame
+    store['peaks'] = peaks
+    assert not store._memory.keys() & frames.keys()
+
+    for key, frame in frames.items():
+        _assertSameFrame(store[key], frame)
+    for name in RaggedPeaks.ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(store['peaks'], name), getattr(peaks, name))
+    assert list(store) == ['a', 'b', 'peaks']
+
+
+def test_failed_spill_keeps_entry(tmp_path, budget):
+    store = ExperimentStore(tmp_path)
+    Path(tmp_path, 'not a directory').touch()
+    store.directory = Path(tmp_path, 'not a directory', 'spill')
+    frame = _frame(10, 3)
+    store['a'] = frame
+    budget(0)
+    store['b'] = _frame(10, 4)
+
+    assert 'a' in store._memory and 'a' not in store._spilled
+    _assertSameFrame(store['a'], frame)
+
+
+def test_memory_cache_is_charged_to_the_budget(tmp_path, budget):
+    budget(1)
+    store = ExperimentStore(tmp_path)
+    cache = experimentstore.MemoryCache(max_entries=2)
+    cache.put('a', 'payload a', 600 << 10)
+    cache.put('b', 'payload b', 300 << 10)
+    assert cache.get('a') == 'payload a' and cache.get('b') == 'payload b'
+
+    # the frame does not fit next to the payloads: the least recently used ones are dropped, not spilled
+    store['frame'] = _frame(5000, 5)
+    assert cache.get('a') is None and cache.get('b') is None
+
+    cache.put('c', 'payload c', 10)
+    cache.put('d', 'payload d', 10)
+    cache.put('e', 'payload e', 10)
+    assert 'c' not in cache and len(cache) == 2
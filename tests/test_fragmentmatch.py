@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from src.fragmentmatch import FragmentIndex, matchScans
+
+
+@pytest.mark.parametrize('tolerance, unit', [(10, 'ppm'), (0.5, 'Da')])
+def test_matches_scans_like_a_scan_over_all_ions(tolerance, unit):
+    fragment_index = FragmentIndex('MFRKLAAECFGTFWLVFGGCGSAVLAAGFPELGIGFAGVALAFGLTVLTMAFAVGHISGG')
+    rng = np.random.default_rng(5)
+    ions = fragment_index.ions
+    # masses close to some ions, and random ones
+    mass_arrays = [np.sort(np.concatenate([rng.choice(ions['mass'], 20) * (1 + rng.normal(0, 5e-6, 20)),
+                                           rng.uniform(100, 7000, 50)])) for _ in range(4)] + [np.zeros(0)]
+    scans = np.arange(len(mass_arrays)) * 2 + 3
+    matches = matchScans(fragment_index, mass_arrays, scans, tolerance, unit)
+
+    expected = []
+    for scan, masses in zip(scans, mass_arrays):
+        for mass_index, mass in enumerate(masses):
+            for ion_id, ion in enumerate(ions.itertuples()):
+                error = mass - ion.mass
+                if unit == 'ppm':
+                    error = error / ion.mass * 1e6
+                width = tolerance if unit == 'Da' else mass * tolerance * 1e-6
+                if abs(mass - ion.mass) <= width:
+                    expected.append((scan, mass_index, ion_id, pytest.approx(error)))
+    assert len(expected) > 0
+    assert list(zip(matches['Scan'], matches['MassIndex'], matches['IonId'], matches['Error'])) == expected
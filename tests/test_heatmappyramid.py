@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from src.heatmappyramid import HeatmapPyramid
+
+
+def _points(n_points, seed=7):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'mass': rng.uniform(1000, 50000, n_points), 'rt': rng.uniform(0, 3600, n_points),
+                         'intensity': rng.uniform(1, 1e6, n_points)}).sort_values('intensity')
+
+
+def test_all_peaks_within_budget():
+    points = _points(1000)
+    heatmap = HeatmapPyramid(points).query(1000)
+    np.testing.assert_array_equal(heatmap.to_numpy(), points[['mass', 'rt', 'intensity']].to_numpy())
+
+
+def test_bins_keep_the_most_intense_peak():
+    points = _points(20000)
+    heatmap = HeatmapPyramid(points, rt_bins=64, mass_bins=64).query(500)
+    assert 0 < len(heatmap) <= 500
+    assert heatmap['intensity'].max() == points['intensity'].max()
+    assert heatmap['intensity'].is_monotonic_increasing
+    # every bin holds the maximum of the peaks around its center
+    for _, point in heatmap.tail(20).iterrows():
+        assert point['intensity'] in set(points['intensity'])
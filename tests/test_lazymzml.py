@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import numpy as np
+from pyopenms import MSExperiment, MzMLFile
+
+from src import lazymzml, masstable, parsecache
+
+
+def test_lazy_rows_match_eager_parse(tagger_experiment, monkeypatch):
+    annotated, deconvolved = tagger_experiment
+    eager_df = masstable.parseFLASHDeconvOutput(annotated, deconvolved)[0]
+    lazy_df = masstable.parseFLASHDeconvOutput(annotated, deconvolved, lazy=True)[0]
+    assert 'mzarray' not in lazy_df.columns
+
+    read = []
+    get_peaks = lazymzml.OnDiscSpectra.getPeaks
+    monkeypatch.setattr(lazymzml.OnDiscSpectra, 'getPeaks', lambda self, index: read.append(index) or
+                        get_peaks(self, index))
+    rows = [len(lazy_df) - 1]
+    peak_df = lazymzml.withPeakColumns(lazy_df, deconvolved, rows)
+    assert read == rows
+    for column in ['mzarray', 'intarray']:
+        np.testing.assert_array_equal(peak_df.loc[rows[0], column], eager_df.loc[rows[0], column])
+    # eagerly parsed frames already have the peaks
+    assert lazymzml.withPeakColumns(eager_df, deconvolved, rows).index.tolist() == rows
+
+
+def test_remove_parsed_output(tmp_path, tagger_experiment):
+    annotated, deconvolved = tagger_experiment
+    for lazy in (False, True):
+        masstable.loadFLASHDeconvOutput(annotated, deconvolved, tmp_path, lazy)
+    assert len(list(parsecache.getCacheDir(tmp_path, '.').iterdir())) == 2
+
+    masstable.removeParsedOutput(tmp_path, deconvolved)
+    assert not list(parsecache.getCacheDir(tmp_path, '.').iterdir())
+
+
+def test_lazy_parse_of_unindexed_files(tmp_path, tagger_experiment):
+    unindexed = []
+    for path in tagger_experiment:
+        experiment = MSExperiment()
+        MzMLFile().load(path, experiment)
+        mzml_file = MzMLFile()
+        options = mzml_file.getOptions()
+        options.setWriteIndex(False)
+        mzml_file.setOptions(options)
+        unindexed.append(str(tmp_path / Path(path).name))
+        mzml_file.store(unindexed[-1], experiment)
+
+    # parsed eagerly instead, the peaks are in the frames
+    df = masstable.parseFLASHDeconvOutput(*unindexed, lazy=True)[0]
+    expected = masstable.parseFLASHDeconvOutput(*tagger_experiment)[0]
+    for column in ['mzarray', 'intarray']:
+        for values, expected_values in zip(df[column], expected[column]):
+            np.testing.assert_array_equal(values, expected_values)
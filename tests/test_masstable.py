@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import masstable
+from tests.conftest import EXAMPLE_DATA
+from tests.reference import masstable as reference
+
+
+def _experiment(number):
+    base = str(EXAMPLE_DATA / 'flashtagger' / ('example_spectrum_%d' % number))
+    return base + '_annotated.mzML', base + '_deconv.mzML'
+
+
+def _lists(values):
+    return [_lists(value) for value in values] if isinstance(values, (list, tuple, np.ndarray)) else values
+
+
+def _approx(values):
+    # the reference reads RTs and intensities through MSExperiment.get_df, i.e. as float32
+    if isinstance(values, (list, tuple, np.ndarray)):
+        return [_approx(value) for value in values]
+    return pytest.approx(float(values), rel=1e-6) if isinstance(values, (float, np.floating)) else values
+
+
+@pytest.mark.parametrize('number', [1, 2])
+def test_parser_matches_reference(number):
+    annotated, deconvolved = _experiment(number)
+    expected_df, expected_anno, *expected_header = reference.parseFLASHDeconvOutput.__wrapped__(annotated, deconvolved)
+    df, anno_df, peaks, *header = masstable.parseFLASHDeconvOutput(annotated, deconvolved)
+
+    assert header == expected_header
+    expected_df = expected_df.rename(columns={'rt': 'RT', 'mz_array': 'mzarray', 'intensity_array': 'intarray'})
+    for column in ['RT', 'mzarray', 'intarray', 'MinCharges', 'MaxCharges', 'MinIsotopes', 'MaxIsotopes',
+                   'PrecursorScan', 'PrecursorMass', 'cos', 'snr', 'qscore', 'qvalue', 'MSLevel', 'Scan']:
+        assert _lists(list(df[column])) == _approx(list(expected_df[column])), column
+    assert peaks.toNestedList('signal') == _approx(list(expected_df['SignalPeaks']))
+    assert peaks.toNestedList('noisy') == _approx(list(expected_df['NoisyPeaks']))
+
+    expected_anno = expected_anno.rename(columns={'rt': 'RT', 'mz_array': 'mzarray', 'intensity_array': 'intarray'})
+    for column in ['RT', 'mzarray', 'intarray']:
+        assert _lists(list(anno_df[column])) == _approx(list(expected_anno[column])), column
+
+
+def test_deconv_mass_info():
+    info = masstable.parseDeconvMassInfo([
+        'tol=5;massoffset=0.000000;chargemass=1.007276;precursorscan=0;precursormass=0;'
+        'peaks=1:3,0:2;2:4,1:1;cos=0.9,0.8,;qscore=0.5,0.6,;',
+        'tol=5;massoffset=0.000000;chargemass=1.007276;precursorscan=3;precursormass=1000.5;peaks=;',
+        'tol=5;massoffset=0.000000;chargemass=1.007276;precursorscan=3;precursormass=2000.5;'
+        'peaks=5:6,0:3;cos=0.7,;qscore=0.1,;',
+    ])
+    assert info['offsets'].tolist() == [0, 2, 2, 3]
+    assert info['MinCharges'].tolist() == [1, 2, 5]
+    assert info['MaxIsotopes'].tolist() == [2, 1, 3]
+    assert info['scores']['cos'].tolist() == [0.9, 0.8, 0.7]
+    assert info['PrecursorMass'].tolist() == [0, 1000.5, 2000.5]
+    assert info['tol'] == 5
+
+
+@pytest.mark.parametrize('scores', ['cos=0.9,;', 'cos=0.9,0.8,0.7,;'])
+def test_deconv_mass_info_score_length(scores):
+    with pytest.raises(ValueError, match='cos'):
+        masstable.parseDeconvMassInfo(['tol=5;precursorscan=0;precursormass=0;peaks=1:3,0:2;2:4,1:1;' + scores])
+
+
+def test_assign_peaks_matches_find_nearest():
+    rng = np.random.default_rng(1)
+    mzs = np.sort(rng.uniform(300, 2000, 3000))
+    masses = rng.uniform(2000, 20000, 40)
+    min_charges = rng.integers(1, 10, 40)
+    max_charges = min_charges + rng.integers(0, 5, 40)
+    max_isotopes = rng.integers(0, 6, 40)
+
+    # the per mass and charge loop of the reference parser
+    expected = []
+    for mass_id, mass in enumerate(masses):
+        for z in range(min_charges[mass_id], max_charges[mass_id] + 1):
+            min_mz = (mass - 3.0)/z + masstable.Constants.PROTON_MASS_U
+            max_mz = (mass + 3.0 + max_isotopes[mass_id] * masstable.Constants.C13C12_MASSDIFF_U)/z \
+                     + masstable.Constants.PROTON_MASS_U
+            nearest = int(np.argmin(np.abs(mzs - min_mz)))
+            for peak_id in range(nearest, len(mzs)):
+                if mzs[peak_id] > max_mz:
+                    break
+                if z == round(mass/mzs[peak_id]):
+                    expected.append((mass_id, peak_id))
+
+    mass_ids, peak_ids = masstable.assignPeaksToMasses(mzs, masses, min_charges, max_charges, max_isotopes)
+    assert list(zip(mass_ids.tolist(), peak_ids.tolist())) == expected
+
+
+def test_ms_signal_df_matches_reference():
+    anno_df = pd.DataFrame({'RT': [1.0, 2.0, 3.0],
+                            'mzarray': [np.array([100.0, 200.0]), np.zeros(0), np.array([300.0, 400.0, 500.0])],
+                            'intarray': [np.array([5.0, 0.0], dtype=np.float32), np.zeros(0, dtype=np.float32),
+                                         np.array([3.0, 7.0, 1.0], dtype=np.float32)]})
+    expected = reference.getMSSignalDF.__wrapped__(anno_df).reset_index(drop=True)
+    signal = masstable.getMSSignalDF.__wrapped__(anno_df).reset_index(drop=True)
+    pd.testing.assert_frame_equal(signal[['mass', 'rt', 'intensity']], expected[['mass', 'rt', 'intensity']],
+                                  check_dtype=False)
+
+
+
+def test_ms_signal_df_without_peaks():
+    anno_df = pd.DataFrame({'RT': [1.0, 2.0], 'mzarray': [np.array([100.0]), np.zeros(0)],
+                            'intarray': [np.array([np.nan], dtype=np.float32), np.zeros(0, dtype=np.float32)]})
+    signal = masstable.getMSSignalDF.__wrapped__(anno_df)
+    assert len(signal) == 0
+    assert list(signal.columns) == ['mass', 'rt', 'intensity']
+
+def test_heatmap_budget(tmp_path):
+    rng = np.random.default_rng(3)
+    n_spectra, n_peaks = 300, 500  # above the default budget
+    anno_df = pd.DataFrame({'RT': np.arange(n_spectra, dtype=np.float64),
+                            'mzarray': list(rng.uniform(1000, 50000, (n_spectra, n_peaks))),
+                            'intarray': list(rng.uniform(1, 1e6, (n_spectra, n_peaks)).astype(np.float32))})
+    path = tmp_path / 'heatmap.mzML'
+    path.write_bytes(b'')
+
+    heatmap = masstable.getHeatmapDF(path, 1, anno_df)
+    assert 0 < len(heatmap) <= masstable.DEFAULT_HEATMAP_BUDGET
+    assert heatmap['intensity'].max() == anno_df['intarray'].map(np.max).max()
+    assert len(masstable.getHeatmapDF(path, 1, anno_df, 0)) == n_spectra * n_peaks
+
+
+def test_explode_tags_matches_loop():
+    tag_df = pd.DataFrame({'Scan': [1, 2, 3], 'ProteinIndex': ['0;2', '1', None],
+                           'StartPos': ['4;10', '7', None], 'DeltaMass': ['0.1;0.2', '0.3', None],
+                           'ProteinAccession': ['A;C', 'B', None], 'TagSequence': ['PEP', 'TID', 'E']})
+    # the row by row loop the viewer used before the tags were exploded on parsing
+    expected = []
+    for _, row in tag_df[tag_df['ProteinIndex'].notna()].iterrows():
+        for i, protein in enumerate(str(row['ProteinIndex']).split(';')):
+            expected.append((row['Scan'], int(protein), int(str(row['StartPos']).split(';')[i]),
+                             float(str(row['DeltaMass']).split(';')[i]), row['ProteinAccession'].split(';')[i]))
+
+    exploded = masstable.explodeTagDF(tag_df)
+    assert list(exploded[['Scan', 'ProteinIndex', 'StartPos', 'DeltaMass', 'ProteinAccession']]
+                .itertuples(index=False, name=None)) == expected
+
+
+def test_protein_coverage_matches_loop():
+    tag_df = pd.DataFrame({'ProteinIndex': [0, 0, 1, 2, 5], 'StartPos': [0, 3, 2, -2, 0], 'EndPos': [4, 9, 2, 1, 3]})
+    lengths = [8, 5, 3]
+    coverages, max_coverages = masstable.getProteinCoverage(tag_df, [0, 1, 2], lengths)
+
+    for protein, length in enumerate(lengths):
+        expected = np.zeros(length)
+        for _, tag in tag_df[tag_df['ProteinIndex'] == protein].iterrows():
+            for position in range(max(tag['StartPos'], 0), min(tag['EndPos'], length - 1) + 1):
+                expected[position] += 1
+        assert max_coverages[protein] == expected.max()
+        np.testing.assert_allclose(coverages[protein], expected / max(expected.max(), 1))
@@ -0,0 +1,104 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import masstable, parsecache
+from tests.conftest import EXAMPLE_DATA
+
+
+def _assertSameOutput(parsed, expected):
+    df, anno_df, peaks, *header = parsed
+    expected_df, expected_anno, expected_peaks, *expected_header = expected
+    assert header == expected_header
+    for frame, expected_frame in [(df, expected_df), (anno_df, expected_anno)]:
+        assert list(frame.columns) == list(expected_frame.columns)
+        for column in frame.columns:
+            for value, expected_value in zip(frame[column], expected_frame[column]):
+                np.testing.assert_array_equal(value, expected_value)
+    for name in peaks.ARRAY_NAMES:
+        np.testing.assert_array_equal(getattr(peaks, name), getattr(expected_peaks, name))
+
+
+def test_cache_round_trip(tmp_path, tagger_experiment):
+    expected = masstable.parseFLASHDeconvOutput(*tagger_experiment)
+    cache_dir = parsecache.getCacheDir(tmp_path, 'experiment')
+    parsecache.writeParsedOutput(cache_dir, 'key', *expected)
+
+    assert parsecache.readParsedOutput(cache_dir, 'other key') is None
+    _assertSameOutput(parsecache.readParsedOutput(cache_dir, 'key'), expected)
+
+
+def test_load_reuses_cache_without_hashing(tmp_path, tagger_experiment, monkeypatch):
+    expected = masstable.loadFLASHDeconvOutput(*tagger_experiment, tmp_path)
+    assert parsecache.getCacheDir(tmp_path, 'example_spectrum_1_deconv').exists()
+
+    def _failHash(path):
+        raise AssertionError('%s was hashed again' % path)
+
+    monkeypatch.setattr(parsecache, 'hashFile', _failHash)
+    monkeypatch.setattr(masstable, 'parseFLASHDeconvOutput', _failHash)
+    _assertSameOutput(masstable.loadFLASHDeconvOutput(*tagger_experiment, tmp_path), expected)
+
+
+def test_frame_round_trip(tmp_path):
+    df = pd.DataFrame({'RT': [1.5, 2.5], 'mzarray': pd.Series([np.array([1.0, 2.0]), np.zeros(0)], dtype=object)})
+    read = parsecache.readFrame(parsecache.writeFrame(df, tmp_path), tmp_path)
+    assert read['RT'].tolist() == [1.5, 2.5]
+    assert [cells.tolist() for cells in read['mzarray']] == [[1.0, 2.0], []]
+
+
+def _taggerExperiments():
+    base = str(EXAMPLE_DATA / 'flashtagger' / 'example_spectrum_%d')
+    return [(base % number + '_annotated.mzML', base % number + '_deconv.mzML') for number in (1, 2)]
+
+
+def test_parallel_load_matches_parser(tmp_path):
+    experiments = _taggerExperiments()
+    loaded = dict(masstable.loadFLASHDeconvOutputs(experiments, tmp_path, max_workers=2))
+    for index, experiment in enumerate(experiments):
+        _assertSameOutput(loaded[index], masstable.parseFLASHDeconvOutput(*experiment))
+
+
+def test_parallel_load_without_cache(tmp_path):
+    # the parse cache can not be created: the workers send the parsed output back
+    Path(tmp_path, parsecache.CACHE_DIR_NAME).touch()
+    experiments = _taggerExperiments()
+    loaded = dict(masstable.loadFLASHDeconvOutputs(experiments, tmp_path, max_workers=2))
+    for index, experiment in enumerate(experiments):
+        _assertSameOutput(loaded[index], masstable.parseFLASHDeconvOutput(*experiment))
+
+
+def test_changed_files(tmp_path):
+    paths = [Path(tmp_path, 'deconv-mzMLs', 'a_deconv.mzML'), Path(tmp_path, 'anno-mzMLs', 'a_annotated.mzML')]
+    for path in paths:
+        path.parent.mkdir()
+        path.write_text('spectra')
+    assert parsecache.getChangedFiles(tmp_path, paths) == paths
+
+    parsecache.recordParsedFiles(tmp_path, paths)
+    assert parsecache.getChangedFiles(tmp_path, paths) == []
+    assert parsecache.getChangedExperiments(tmp_path, {'deconv-mzMLs': ['a_deconv.mzML']}) == set()
+
+    paths[0].write_text('other spectra')
+    paths[1].unlink()
+    assert parsecache.getChangedFiles(tmp_path, paths) == paths
+    assert parsecache.getChangedExperiments(tmp_path, {'anno-mzMLs': ['a_annotated.mzML']}) == {'a'}
+
+
+def test_reload_after_rewrite_in_place(tmp_path):
+    # a workflow run writes its output again at the same paths
+    (first, second) = _taggerExperiments()
+    experiment = (Path(tmp_path, 'e_annotated.mzML'), Path(tmp_path, 'e_deconv.mzML'))
+    for source, path in zip(first, experiment):
+        shutil.copyfile(source, path)
+    _assertSameOutput(dict(masstable.loadFLASHDeconvOutputs([experiment], tmp_path))[0],
+                      masstable.parseFLASHDeconvOutput(*first))
+
+    for source, path in zip(second, experiment):
+        shutil.copyfile(source, path)
+    expected = masstable.parseFLASHDeconvOutput(*second)
+    _assertSameOutput(dict(masstable.loadFLASHDeconvOutputs([experiment], tmp_path))[0], expected)
+    # and the parse cache holds the new output too
+    _assertSameOutput(masstable.loadFLASHDeconvOutput(*experiment, tmp_path), expected)
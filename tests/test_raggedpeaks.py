@@ -0,0 +1,42 @@
+import numpy as np
+
+from src.raggedpeaks import RaggedPeaks
+
+
+def _scans():
+    # per scan: number of masses and per mass [peak index, mz, intensity, charge, is signal] of its peaks
+    return [
+        [[[0, 100.5, 10.0, 2, True], [3, 101.0, 20.0, 2, False]], [], [[7, 500.25, 5.0, 1, True]]],
+        [],
+        [[[1, 200.0, 1.0, 4, False]]],
+    ]
+
+
+def _fromNested(scans):
+    scan_peaks = []
+    for masses in scans:
+        mass_ids = [mass_id for mass_id, peaks in enumerate(masses) for _ in peaks]
+        peaks = [peak for mass_peaks in masses for peak in mass_peaks]
+        columns = list(zip(*peaks)) if peaks else [[]] * 5
+        scan_peaks.append((len(masses), np.array(mass_ids, dtype=np.int64), *[np.array(c) for c in columns]))
+    return RaggedPeaks.fromScans(scan_peaks)
+
+
+def _expected(scans, kind=None):
+    # the nested [peak index, mz, intensity, charge] lists the parser built before
+    return [[[peak[:4] for peak in peaks if kind is None or peak[4] == (kind == 'signal')] for peaks in masses]
+            for masses in scans]
+
+
+def test_nested_list_matches_lists():
+    peaks = _fromNested(_scans())
+    assert len(peaks) == 3
+    for kind in [None, 'signal', 'noisy']:
+        assert peaks.toNestedList(kind) == _expected(_scans(), kind)
+
+
+def test_select_and_scan():
+    peaks = _fromNested(_scans())
+    assert peaks.select([2, 0]).toNestedList() == _expected([_scans()[2], _scans()[0]])
+    assert peaks.scan(1).toNestedList() == [[]]
+    assert peaks.scan(0).toNestedList('signal') == _expected(_scans()[:1], 'signal')
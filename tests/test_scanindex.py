@@ -0,0 +1,29 @@
+import numpy as np
+
+from src.scanindex import ScanIndex
+
+
+def _indexOf(scans, queries):
+    # the linear lookup the viewers used before, the first spectrum wins
+    scans = list(scans)
+    return [scans.index(scan) if scan >= 0 and scan in scans else -1 for scan in queries]
+
+
+def test_index_of_matches_lookup():
+    rng = np.random.default_rng(3)
+    scans = rng.integers(-1, 50, 200)
+    queries = np.arange(-3, 60)
+    assert ScanIndex(scans).indexOf(queries).tolist() == _indexOf(scans, queries)
+
+
+def test_large_sparse_scan_numbers():
+    scans = [10**12, 7, 2**40, 7, -1]
+    index = ScanIndex(scans, [1, 2, 2, 1, 2])
+    assert index.indexOf([7, 2**40, 10**12, 8, -1, 2**50]).tolist() == [1, 2, 0, -1, -1, -1]
+    assert index.rowsOfLevel(2).tolist() == [1, 2, 4]
+    assert index.rowsOfLevel(3).tolist() == []
+
+
+def test_empty():
+    assert ScanIndex([]).indexOf([1, 2]).tolist() == [-1, -1]
+    assert ScanIndex([-1, -1]).indexOf([-1, 0]).tolist() == [-1, -1]
@@ -0,0 +1,70 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import sequence
+from tests.conftest import EXAMPLE_DATA
+from tests.reference import sequence as reference
+
+# Aquaporin Z, with cysteines and methionines for the fixed modifications
+SEQUENCE = pd.read_csv(EXAMPLE_DATA / 'flashtagger' / 'example_spectrum_2_protein.tsv', sep='\t')['ProteinSequence'][0]
+
+
+@pytest.mark.parametrize('fixed_mods', [(None, None), ('Carbamidomethyl (+57)', 'L-methionine sulfoxide (+16)')])
+def test_fragment_ladders_match_reference(monkeypatch, fixed_mods):
+    monkeypatch.setattr(reference, 'st', SimpleNamespace(
+        session_state={'fixed_mod_cysteine': fixed_mods[0], 'fixed_mod_methionine': fixed_mods[1]}))
+    expected = reference.getFragmentDataFromSeq(SEQUENCE)
+    arrays = sequence.getFragmentArrays.__wrapped__(SEQUENCE, fixed_mods, 'axbycz')
+
+    assert float(arrays['theoretical_mass']) == pytest.approx(expected['theoretical_mass'], rel=1e-12)
+    assert arrays['fixed_modifications'].tolist() == expected['fixed_modifications']
+    for ion_type in 'axbycz':
+        name = 'fragment_masses_%s' % ion_type
+        np.testing.assert_allclose(arrays[name], expected[name], rtol=1e-12, err_msg=name)
+
+
+@pytest.mark.parametrize('res_type', ['by', 'bz', 'cy'])
+def test_internal_fragments_match_reference(res_type):
+    expected = reference.getInternalFragmentMassesWithSeq(SEQUENCE, res_type)
+    # a small chunk size to go through several chunks
+    masses, start_indices, end_indices = sequence.getInternalFragmentMassesWithSeq(SEQUENCE, res_type, chunk_size=1000)
+
+    assert masses.dtype == np.float64
+    np.testing.assert_allclose(masses, expected[0], rtol=1e-12)
+    assert start_indices.tolist() == expected[1]
+    assert end_indices.tolist() == expected[2]
+
+
+def test_fragment_store_drops_least_recently_used(tmp_path):
+    paths = [sequence._fragmentStorePath(tmp_path, ('fragments', str(index))) for index in range(3)]
+    for age, path in enumerate(paths):
+        sequence._writeFragmentStore(path, {'masses': np.zeros(1000)})
+        os.utime(path, (1000 - age, 1000 - age))  # the first one is the most recent
+    assert sequence._readFragmentStore(paths[2]) is not None  # used again
+
+    size = paths[0].stat().st_size
+    sequence._pruneFragmentStore(paths[0].parent, max_bytes=2 * size)
+    assert [path.exists() for path in paths] == [True, False, True]
+
+
+def test_fragment_ladders_batch_matches_single_sequences():
+    sequences = [SEQUENCE, '', 'PEPTIDE', 'C', SEQUENCE[::-1]]
+    fixed_mods = ('Carbamidomethyl (+57)', None)
+    ladders = sequence.getFragmentLaddersBatch(sequences, fixed_mods)
+    offsets = ladders['offsets']
+    for index, protein in enumerate(sequences):
+        arrays = sequence.getFragmentArrays.__wrapped__(protein, fixed_mods, 'axbycz')
+        assert ladders['theoretical_masses'][index] == pytest.approx(float(arrays['theoretical_mass']), rel=1e-12)
+        for ion_type in 'axbycz':
+            np.testing.assert_allclose(ladders[ion_type][offsets[index]:offsets[index + 1]],
+                                       arrays['fragment_masses_%s' % ion_type], rtol=1e-12)
+
+
+@pytest.mark.parametrize('protein', ['PEPTXDE', 'peptide', 'PEPTÍDE', 'PEP TIDE'])
+def test_fragment_ladders_batch_unknown_residues(protein):
+    with pytest.raises(ValueError, match='Sequence 1'):
+        sequence.getFragmentLaddersBatch(['PEPTIDE', protein], (None, None))
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from src import taggerview
+
+
+def _viewModel():
+    spec_df = pd.DataFrame({'Scan': [1, 2, 3], 'MSLevel': [1, 2, 2]})
+    tag_df = pd.DataFrame({'Scan': [3], 'ProteinIndex': [0], 'StartPos': [1], 'Length': [2],
+                           'DeNovoScore': [1.0], 'Masses': [[1.0]]})
+    protein_df = pd.DataFrame({'ProteinIndex': [0], 'ProteinAccession': ['A'], 'ProteinDescription': [''],
+                               'ProteinSequence': ['PEPCMIDE']})
+    return taggerview.TaggerViewModel(spec_df, tag_df, protein_df)
+
+
+def test_sequence_data_follows_fixed_modifications(monkeypatch):
+    fixed_mods = [(None, None)]
+    monkeypatch.setattr(taggerview, 'getFixedModifications', lambda: fixed_mods[0])
+    view_model = _viewModel()
+    unmodified = view_model.getSequenceData()[0]['theoretical_mass']
+
+    fixed_mods[0] = ('Carbamidomethyl (+57)', None)
+    modified = view_model.getSequenceData()
+    assert modified[0]['theoretical_mass'] > unmodified
+    # kept for the next reruns with the same modifications
+    assert view_model.getSequenceData() is modified
+    assert view_model.fixed_modifications == fixed_mods[0]
+
+
+def test_versions_are_not_reused(monkeypatch):
+    monkeypatch.setattr(taggerview, 'getFixedModifications', lambda: (None, None))
+    versions = [_viewModel().version for _ in range(3)]  # each one is garbage collected before the next
+    assert len(set(versions)) == 3